@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Benchmarks for the web panel's hot paths.
+
+Builds synthetic RetroPie trees (flat and deep, 1k/10k/100k files by default)
+in a scratch directory, points web_panel at them and measures:
+
+  - directory listings (HTML page, /api/list, cold cache, 304 revalidation),
+    through the Flask test client and through a real local socket;
+  - monitoring (collect_monitoring_data() and /api/monitoring), with vcgencmd,
+    nvme and sudo replaced by fake executables so the subprocess fallbacks run
+    everywhere (on a Pi the sysfs sensors are still read first);
+  - upload and download throughput over a real socket.
+
+Latencies are reported as p50/p99 in milliseconds, transfers in MB/s, and
+peak_rss_mb is the process's peak RSS once the scenario has finished.
+Results go to stdout (or --output) as JSON; pass an earlier file to --compare
+to print the changes. Needs the same environment as the panel itself
+(web_panel creates /home/pi/tmp on import).
+
+    python3 benchmark.py --sizes 1000,10000 --output before.json
+    python3 benchmark.py --sizes 1000,10000 --compare before.json
+"""
+import argparse
+import atexit
+import base64
+import http.client
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SHAPES = ('flat','deep')
+DEEP_FANOUT = 10
+DEEP_LEVELS = 3
+
+FAKE_COMMANDS = {
+    'vcgencmd': """#!/bin/sh
+case "$1" in
+  measure_temp) echo "temp=48.3'C" ;;
+  get_throttled) echo "throttled=0x0" ;;
+  *) exit 1 ;;
+esac
+""",
+    'nvme': """#!/bin/sh
+echo "Smart Log for NVME device:nvme0 namespace-id:ffffffff"
+echo "critical_warning                        : 0"
+echo "temperature                             : 38 C"
+echo "Temperature Sensor 1                    : 38 C"
+echo "Temperature Sensor 2                    : 42 C"
+""",
+    'sudo': """#!/bin/sh
+exec "$@"
+""",
+}
+
+def install_fake_commands(bin_dir):
+    os.makedirs(bin_dir,exist_ok=True)
+    for name,script in FAKE_COMMANDS.items():
+        p=os.path.join(bin_dir,name)
+        with open(p,'w') as f: f.write(script)
+        os.chmod(p,0o755)
+    os.environ['PATH']=bin_dir+os.pathsep+os.environ.get('PATH','')
+
+# --- Synthetic trees ---
+def _touch(path, i):
+    with open(path,'wb') as f:
+        f.truncate((i*7919)%(4*1024*1024))
+
+def make_tree(root, shape, count):
+    """Create *count* files below *root*: all in one folder (flat), or spread
+    over DEEP_FANOUT**DEEP_LEVELS leaf folders (deep)."""
+    os.makedirs(root,exist_ok=True)
+    if shape=='flat':
+        for i in range(count):
+            _touch(os.path.join(root,f"Game {i:06d} (USA).zip"),i)
+        return root
+    leaves=DEEP_FANOUT**DEEP_LEVELS
+    for i in range(count):
+        leaf=i%leaves; parts=[]
+        for _ in range(DEEP_LEVELS):
+            parts.append(f"d{leaf%DEEP_FANOUT}"); leaf//=DEEP_FANOUT
+        d=os.path.join(root,*parts)
+        if i<leaves: os.makedirs(d,exist_ok=True)
+        _touch(os.path.join(d,f"Game {i:06d}.7z"),i)
+    return root
+
+# --- Measurement ---
+def percentile(values, p):
+    s=sorted(values)
+    return s[min(len(s)-1,max(0,int(round(p/100.0*len(s)+0.5))-1))]
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,1)
+
+def measure(fn, iterations, max_seconds, setup=None):
+    """Time fn() up to *iterations* times, stopping early (after at least 5
+    runs) once *max_seconds* have passed. *setup* runs untimed before each call."""
+    times=[]; deadline=time.perf_counter()+max_seconds
+    fn()  # warm-up
+    for i in range(iterations):
+        if setup: setup()
+        t0=time.perf_counter(); fn(); times.append(time.perf_counter()-t0)
+        if i>=4 and time.perf_counter()>deadline: break
+    return times
+
+def summarize(name, tree, transport, times, nbytes=None):
+    r={'name':name,'tree':tree,'transport':transport,'n':len(times),
+       'p50_ms':round(percentile(times,50)*1000,3),'p99_ms':round(percentile(times,99)*1000,3),
+       'mean_ms':round(sum(times)/len(times)*1000,3)}
+    if nbytes:
+        r['mb_s']=round(nbytes/percentile(times,50)/1e6,1)
+    r['peak_rss_mb']=peak_rss_mb()
+    return r
+
+# --- Clients ---
+class SocketClient:
+    """Requests over one keep-alive HTTP connection to the local server."""
+    def __init__(self, port, auth):
+        self.conn=http.client.HTTPConnection('127.0.0.1',port,timeout=300)
+        self.auth=auth
+    def request(self, method, url, body=None, headers=None):
+        h={'Authorization':self.auth,'Accept-Encoding':'gzip, br'}
+        h.update(headers or {})
+        self.conn.request(method,url,body=body,headers=h)
+        resp=self.conn.getresponse(); n=0
+        while True:
+            chunk=resp.read(1024*1024)
+            if not chunk: break
+            n+=len(chunk)
+        if resp.status>=400: raise RuntimeError(f"{method} {url}: {resp.status}")
+        return resp,n
+    def close(self): self.conn.close()
+
+def multipart_body(field, filename, size, block):
+    boundary=uuid.uuid4().hex
+    head=(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+          'Content-Type: application/octet-stream\r\n\r\n').encode()
+    tail=f'\r\n--{boundary}--\r\n'.encode()
+    def chunks():
+        yield head
+        left=size
+        while left>0:
+            yield block[:left]; left-=len(block)
+        yield tail
+    return chunks(),len(head)+size+len(tail),f'multipart/form-data; boundary={boundary}'
+
+# --- Scenarios ---
+def bench_listing(w, client, sock, trees, args):
+    results=[]; auth=client_auth(w)
+    for tree,path in trees:
+        url='/'+os.path.relpath(path,w.BASE_DIR)
+        def page(): client.get(url,headers=auth).get_data()
+        def api(): client.get('/api/list'+url,headers=auth).get_data()
+        def forget(): w.invalidate_listing(path)
+        results.append(summarize('list_html',tree,'test_client',measure(page,args.iterations,args.max_seconds)))
+        results.append(summarize('list_html_cold',tree,'test_client',measure(page,args.iterations,args.max_seconds,setup=forget)))
+        results.append(summarize('list_api',tree,'test_client',measure(api,args.iterations,args.max_seconds)))
+        etag=client.get(url,headers=auth).headers.get('ETag')
+        def revalidate():
+            r=client.get(url,headers={**auth,'If-None-Match':etag})
+            assert r.status_code==304,r.status_code
+        if etag:
+            results.append(summarize('list_revalidate',tree,'test_client',measure(revalidate,args.iterations,args.max_seconds)))
+        results.append(summarize('list_html',tree,'socket',measure(lambda: sock.request('GET',url),args.iterations,args.max_seconds)))
+        log(f"listing {tree} done")
+    return results
+
+def bench_monitoring(w, client, args):
+    auth=client_auth(w); results=[]
+    results.append(summarize('monitor_collect','-','direct',measure(w.collect_monitoring_data,args.iterations,args.max_seconds)))
+    results.append(summarize('monitor_api','-','test_client',measure(lambda: client.get('/api/monitoring',headers=auth).get_data(),args.iterations,args.max_seconds)))
+    log("monitoring done")
+    return results
+
+def bench_transfers(w, sock, target, args):
+    size=args.transfer_mb*1024*1024; block=os.urandom(1024*1024)
+    url='/'+os.path.relpath(target,w.BASE_DIR)
+    up=[]; down=[]
+    for i in range(args.transfer_runs):
+        body,length,ctype=multipart_body('file','transfer.bin',size,block)
+        t0=time.perf_counter()
+        sock.request('POST','/upload'+url,body=body,headers={'Content-Type':ctype,'Content-Length':str(length)})
+        up.append(time.perf_counter()-t0)
+        t0=time.perf_counter()
+        _,n=sock.request('GET',url+'/transfer.bin',headers={'Accept-Encoding':'identity'})
+        down.append(time.perf_counter()-t0)
+        if n!=size: raise RuntimeError(f"downloaded {n} of {size} bytes")
+    log("transfers done")
+    return [summarize('upload',f"{args.transfer_mb}MiB",'socket',up,size),
+            summarize('download',f"{args.transfer_mb}MiB",'socket',down,size)]
+
+# --- Setup ---
+def log(msg): print(msg,file=sys.stderr,flush=True)
+
+def client_auth(w):
+    token=base64.b64encode(f"{w.CONFIG['login']}:{w.CONFIG['password']}".encode()).decode()
+    return {'Authorization':'Basic '+token}
+
+def start_server(w):
+    from werkzeug.serving import WSGIRequestHandler
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *a): pass
+    srv=w.PooledWSGIServer('127.0.0.1',0,w.app,w.CONFIG['threads'],handler=QuietHandler)
+    threading.Thread(target=srv.serve_forever,name='bench-server',daemon=True).start()
+    return srv
+
+def git_revision():
+    try: return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=HERE,stderr=subprocess.DEVNULL).decode().strip()
+    except Exception: return None
+
+def compare(old, new, out):
+    key=lambda r:(r['name'],r['tree'],r['transport'])
+    before={key(r):r for r in old['results']}
+    print(f"{'scenario':<44}{'p50 ms':>22}{'MB/s':>20}",file=out)
+    for r in new['results']:
+        o=before.get(key(r))
+        if not o: continue
+        def delta(field, better_low):
+            if field not in r or not o.get(field): return ''
+            pct=(r[field]-o[field])/o[field]*100
+            sign='' if abs(pct)<5 else ('+' if (pct<0)==better_low else '-')
+            return f"{o[field]:.1f} -> {r[field]:.1f} {sign}"
+        print(f"{'/'.join(key(r)):<44}{delta('p50_ms',True):>22}{delta('mb_s',False):>20}",file=out)
+
+def main():
+    ap=argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--sizes',default='1000,10000,100000',help='comma-separated file counts per tree')
+    ap.add_argument('--shapes',default=','.join(SHAPES))
+    ap.add_argument('--iterations',type=int,default=50)
+    ap.add_argument('--max-seconds',type=float,default=10.0,help='time budget per scenario')
+    ap.add_argument('--transfer-mb',type=int,default=256)
+    ap.add_argument('--transfer-runs',type=int,default=3)
+    ap.add_argument('--workdir',help='scratch directory (default: a new temporary one, removed afterwards)')
+    ap.add_argument('--output',help='write JSON here instead of stdout')
+    ap.add_argument('--compare',help='JSON from an earlier run to compare against')
+    args=ap.parse_args()
+
+    work=args.workdir or tempfile.mkdtemp(prefix='panel-bench-')
+    if not args.workdir: atexit.register(shutil.rmtree,work,True)
+    install_fake_commands(os.path.join(work,'bin'))
+    sys.path.insert(0,HERE)
+    import web_panel as w
+    # Keep every file the panel writes inside the scratch directory.
+    w.BASE_DIR=os.path.join(work,'RetroPie')
+    w.LIBRARY_DB=os.path.join(work,'library.db')
+    w.HISTORY_FILE=os.path.join(work,'history.rrd')
+    w.CONFIG.path=os.path.join(work,'config.cfg')
+    w.CONFIG.update(sensor_fallback=True,show_nvme=True,index_interval=0)
+
+    trees=[]
+    for shape in args.shapes.split(','):
+        for count in (int(n) for n in args.sizes.split(',')):
+            name=f"{shape}-{count}"
+            t0=time.perf_counter()
+            root=make_tree(os.path.join(w.BASE_DIR,'roms',name),shape,count)
+            log(f"created {name} in {time.perf_counter()-t0:.1f}s")
+            trees.append((name,root))
+    target=os.path.join(w.BASE_DIR,'roms','transfer'); os.makedirs(target,exist_ok=True)
+
+    # Let the initial library scan finish so it does not run during the measurements.
+    lib=w.get_library()
+    while lib.last_scan is None: time.sleep(0.1)
+    log(f"library scan took {lib.last_duration:.1f}s")
+    w.get_sampler()
+
+    srv=start_server(w); client=w.app.test_client()
+    sock=SocketClient(srv.server_port,client_auth(w)['Authorization'])
+    results=[summarize('library_scan','all','direct',[lib.last_duration])]
+    try:
+        results+=bench_listing(w,client,sock,trees,args)
+        results+=bench_monitoring(w,client,args)
+        results+=bench_transfers(w,sock,target,args)
+    finally:
+        sock.close(); srv.shutdown(); srv.server_close()
+
+    report={'meta':{'time':time.strftime('%Y-%m-%dT%H:%M:%S'),'revision':git_revision(),
+                    'python':platform.python_version(),'machine':platform.machine(),
+                    'cpus':os.cpu_count(),'args':vars(args)},
+            'results':results}
+    text=json.dumps(report,indent=1)
+    if args.output:
+        with open(args.output,'w') as f: f.write(text+'\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f: old=json.load(f)
+        # The table goes to stderr when the JSON itself is on stdout.
+        compare(old,report,sys.stdout if args.output else sys.stderr)
+
+if __name__=='__main__':
+    main()
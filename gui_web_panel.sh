@@ -39,14 +39,32 @@ EOF
 fi
 
 # Function to save the configuration back to config.cfg
+# Only the keys managed here are rewritten; every other line (settings changed
+# from the web panel meanwhile, comments) is kept. The file is replaced via a
+# temp file and mv, so the running web panel never reads it half-written and
+# picks the change up within a few seconds.
+MANAGED_KEYS="login password secret_key port monitor_refresh"
 save_config() {
-  cat <<EOF > "$CONFIG_FILE"
-login=${CONFIG[login]}
-password=${CONFIG[password]}
-secret_key=${CONFIG[secret_key]}
-port=${CONFIG[port]}
-monitor_refresh=${CONFIG[monitor_refresh]}
-EOF
+  local tmp="$CONFIG_FILE.tmp.$$" line key
+  declare -A written=()
+  {
+    if [ -f "$CONFIG_FILE" ]; then
+      while IFS= read -r line || [ -n "$line" ]; do
+        key="${line%%=*}"
+        if [[ "$line" == *=* && " $MANAGED_KEYS " == *" $key "* ]]; then
+          echo "$key=${CONFIG[$key]}"
+          written[$key]=1
+        else
+          echo "$line"
+        fi
+      done < "$CONFIG_FILE"
+    fi
+    for key in $MANAGED_KEYS; do
+      if [ -z "${written[$key]}" ]; then
+        echo "$key=${CONFIG[$key]}"
+      fi
+    done
+  } > "$tmp" && sync && mv -f "$tmp" "$CONFIG_FILE" || rm -f "$tmp"
 }
 
 # Function: Configure Credentials Menu
@@ -1,70 +1,232 @@
 #!/usr/bin/env python3
+import atexit
+import base64
+import errno
+import gzip
+import hashlib
+import itertools
+import http.client
+import io
+import json
+import math
+import mimetypes
+import mmap
 import os
 import posixpath
 import shutil
+import signal
+import socket
+import sqlite3
+import stat
 import psutil
+import queue
 import subprocess
+import tarfile
 import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import zipfile
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
-from flask import Flask, request, render_template_string, redirect, url_for, send_from_directory, flash, abort, Response, jsonify
+from flask import Flask, Request, request, render_template, redirect, url_for, flash, get_flashed_messages, session, abort, Response, jsonify, stream_with_context
 from functools import wraps
+from types import MappingProxyType
+from jinja2 import FileSystemBytecodeCache, Template
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, is_resource_modified, parse_range_header
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
 from werkzeug.utils import secure_filename
+from xml.etree import ElementTree
 
 # --- Configuration file handling ---
+# config.cfg is parsed once into an immutable snapshot; request handlers read
+# CONFIG like a dict, which only dereferences the current snapshot (no lock,
+# no disk access). CONFIG.update() swaps in a new snapshot and schedules a
+# write, so bursts of changes are coalesced into one atomic rewrite (temp
+# file, fsync, rename) CONFIG_DEBOUNCE seconds later. The same thread polls
+# the file every CONFIG_POLL seconds and, once an outside edit (e.g. from
+# gui_web_panel.sh) has settled, merges the keys it changed without a restart.
 CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.cfg")
+CONFIG_DEFAULTS = {
+    "login": "admin",
+    "password": "admin",
+    "secret_key": "your_secret_key",
+    "port": 5000,
+    "debug": False,
+    "threads": 16,
+    "keepalive": 5,
+    "request_timeout": 120,
+    "graceful_timeout": 30,
+    "monitor_refresh": 0.5,
+    "sample_interval": 1.0,
+    "sample_history": 120,
+    "ssd_sensor": "",
+    "index_interval": 600,
+    "template_cache": True,
+    "hash_workers": 2,
+    "compress_min_size": 1024,
+    "show_nvme": False,
+    "sensor_fallback": False,
+    "config_location": "64",
+    "peers": "",
+    "fleet_refresh": 2.0,
+    "peer_timeout": 2.0
+}
+CONFIG_INT_KEYS = ("port","sample_history","index_interval","threads","keepalive","request_timeout","graceful_timeout","compress_min_size","hash_workers")
+CONFIG_FLOAT_KEYS = ("monitor_refresh","sample_interval","fleet_refresh","peer_timeout")
+CONFIG_BOOL_KEYS = ("show_nvme","sensor_fallback","debug","template_cache")
+CONFIG_DEBOUNCE = 1.0
+CONFIG_POLL = 2.0
 
-def load_config():
-    config = {
-        "login": "admin",
-        "password": "admin",
-        "secret_key": "your_secret_key",
-        "port": 5000,
-        "monitor_refresh": 0.5,
-        "ssd_sensor": "",
-        "show_nvme": False,
-        "config_location": "64"
-    }
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if "=" in line:
-                    key, val = line.split("=", 1)
-                    key, val = key.strip(), val.strip()
-                    if key == "port":
-                        try: config[key] = int(val)
-                        except: pass
-                    elif key == "monitor_refresh":
-                        try: config[key] = float(val)
-                        except: pass
-                    elif key == "show_nvme":
-                        config[key] = (val.lower()=="true")
-                    else:
-                        config[key] = val
-    else:
-        save_config(config)
+def parse_config(text):
+    config={}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, val = line.split("=", 1)
+        key, val = key.strip(), val.strip()
+        if key in CONFIG_INT_KEYS:
+            try: config[key] = int(val)
+            except: pass
+        elif key in CONFIG_FLOAT_KEYS:
+            try: config[key] = float(val)
+            except: pass
+        elif key in CONFIG_BOOL_KEYS:
+            config[key] = (val.lower()=="true")
+        else:
+            config[key] = val
     return config
 
-def save_config(config):
+def format_config(config):
+    return "".join(f"{k}={('True' if v else 'False') if isinstance(v,bool) else v}\n" for k,v in config.items())
+
+def atomic_write(path, data):
+    """Replace *path* with *data* so readers see either the old or the new file, even after a power cut."""
+    d=os.path.dirname(path)
+    fd,tmp=tempfile.mkstemp(dir=d,prefix="."+os.path.basename(path)+".")
     try:
-        with open(CONFIG_FILE, "w") as f:
-            for k,v in config.items():
-                if isinstance(v,bool):
-                    f.write(f"{k}={'True' if v else 'False'}\n")
-                else:
-                    f.write(f"{k}={v}\n")
-    except PermissionError:
-        os.chmod(CONFIG_FILE,0o666)
-        with open(CONFIG_FILE, "w") as f:
-            for k,v in config.items():
-                if isinstance(v,bool):
-                    f.write(f"{k}={'True' if v else 'False'}\n")
-                else:
-                    f.write(f"{k}={v}\n")
+        with os.fdopen(fd,"w") as f:
+            f.write(data); f.flush(); os.fsync(f.fileno())
+        try: os.chmod(tmp,stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError: os.chmod(tmp,0o644)
+        os.replace(tmp,path)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    dfd=os.open(d,os.O_RDONLY)
+    try: os.fsync(dfd)
+    finally: os.close(dfd)
+
+def _file_signature(path):
+    try: st=os.stat(path)
+    except FileNotFoundError: return None
+    return (st.st_ino,st.st_size,st.st_mtime_ns)
 
-CONFIG = load_config()
+class ConfigStore(threading.Thread):
+    def __init__(self, path):
+        super().__init__(name="config-store", daemon=True)
+        self.path=path
+        self.lock=threading.Lock()
+        self.wake=threading.Event()
+        self.listeners=[]
+        self.version=0
+        self.dirty=False; self.deadline=0.0; self.seen=None
+        self.signature=_file_signature(path)
+        # file_values: what config.cfg held when last read or written, the base
+        # for telling which keys an outside edit actually changed.
+        self.file_values=self._read()
+        values=dict(CONFIG_DEFAULTS); values.update(self.file_values)
+        self.snapshot=MappingProxyType(values)
+        if self.signature is None: self._schedule()
+    def _read(self):
+        try:
+            with open(self.path) as f: return parse_config(f.read())
+        except FileNotFoundError:
+            return {}
+    def __getitem__(self, key): return self.snapshot[key]
+    def __contains__(self, key): return key in self.snapshot
+    def get(self, key, default=None): return self.snapshot.get(key,default)
+    def items(self): return self.snapshot.items()
+    def on_change(self, fn):
+        """Call fn(old, new) with both snapshots after every change."""
+        self.listeners.append(fn)
+    def _apply(self, changes):
+        old=self.snapshot
+        values=dict(old); values.update(changes)
+        if values==old: return
+        self.snapshot=MappingProxyType(values); self.version+=1
+        for fn in self.listeners:
+            try: fn(old,self.snapshot)
+            except Exception as e: app.logger.warning("Config listener failed: %s",e)
+    def _schedule(self):
+        self.dirty=True; self.deadline=time.monotonic()+CONFIG_DEBOUNCE
+        self.wake.set()
+    def watch(self):
+        """Start the writer/watcher thread in this process. It is never started
+        on import: gunicorn imports the module in its master and forks the
+        worker, and threads do not survive a fork."""
+        if self.ident is None:
+            with self.lock:
+                if self.ident is None: self.start()
+    def update(self, **changes):
+        with self.lock:
+            old=self.snapshot
+            self._apply(changes)
+            if self.snapshot is not old: self._schedule()
+        self.watch()
+    def _merge_file(self):
+        # Apply only the keys the file changed since we last read or wrote it,
+        # so local updates made meanwhile survive an outside edit.
+        values=self._read()
+        self.signature=_file_signature(self.path)
+        changes={k:v for k,v in values.items() if self.file_values.get(k)!=v}
+        self.file_values=values
+        self._apply(changes)
+        return changes
+    def flush(self):
+        with self.lock:
+            if not self.dirty: return
+            if _file_signature(self.path) not in (self.signature,None): self._merge_file()
+            values=dict(self.snapshot)
+            try:
+                atomic_write(self.path,format_config(values))
+            except OSError as e:
+                app.logger.warning("Could not write %s: %s",self.path,e)
+                self.deadline=time.monotonic()+CONFIG_POLL
+                return
+            self.dirty=False; self.file_values=values
+            self.signature=self.seen=_file_signature(self.path)
+    def reload_if_changed(self):
+        sig=_file_signature(self.path)
+        if sig==self.signature or sig is None: return
+        # Wait until the file has looked the same for one poll, so a
+        # half-written file from a non-atomic editor is never loaded.
+        if sig!=self.seen:
+            self.seen=sig; return
+        with self.lock: changes=self._merge_file()
+        if changes: app.logger.info("Reloaded %s: %s",self.path,", ".join(sorted(changes)))
+    def run(self):
+        while True:
+            timeout=CONFIG_POLL
+            if self.dirty: timeout=max(0.0,min(timeout,self.deadline-time.monotonic()))
+            self.wake.wait(timeout); self.wake.clear()
+            try:
+                self.reload_if_changed()
+                if self.dirty and time.monotonic()>=self.deadline: self.flush()
+            except Exception as e:
+                app.logger.warning("Config watcher failed: %s",e)
+
+CONFIG = ConfigStore(CONFIG_FILE)
+atexit.register(CONFIG.flush)
 
 # --- Temporary directory ---
 TEMP_DIR = '/home/pi/tmp'
@@ -73,11 +235,260 @@ if not os.path.exists(TEMP_DIR):
 os.environ['TMPDIR'] = TEMP_DIR
 tempfile.tempdir = TEMP_DIR
 
-app = Flask(__name__)
+def private_dir(path):
+    """Create *path* as a 0700 directory; raises OSError if it exists and belongs to another user."""
+    os.makedirs(path,mode=0o700,exist_ok=True)
+    st=os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid!=os.geteuid():
+        raise OSError(errno.EPERM,"Not a directory owned by this user",path)
+    if st.st_mode&0o077: os.chmod(path,0o700)
+    return path
+
+# --- Streaming uploads ---
+# Werkzeug's multipart parser asks the request for a file object per uploaded
+# part. For uploads we hand it a temporary file inside the destination folder,
+# so the body is written once, straight to its final filesystem, and the
+# handler only has to rename it into place. Other requests keep the default
+# spooling behaviour.
+UPLOAD_BUFFER = 1024*1024
+# Unfinished uploads (streamed and chunked) are kept under this prefix in their
+# target folder; listings and the library index leave them out.
+UPLOAD_PART_PREFIX = '.upload-'
+_UMASK = os.umask(0); os.umask(_UMASK)
+
+class _UploadPart:
+    """Temporary file for one uploaded part; adds up the time spent writing to it."""
+    def __init__(self, f):
+        self.f=f; self.write_time=0.0
+    def write(self, data):
+        t0=time.perf_counter()
+        try: return self.f.write(data)
+        finally: self.write_time+=time.perf_counter()-t0
+    def __getattr__(self, name):
+        return getattr(self.f,name)
+
+class PanelRequest(Request):
+    upload_dir = None
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_dir is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        f=tempfile.NamedTemporaryFile('wb+',buffering=UPLOAD_BUFFER,dir=self.upload_dir,
+                                      prefix=UPLOAD_PART_PREFIX,suffix='.part',delete=False)
+        self.upload_parts.append(f.name)
+        return _UploadPart(f)
+    def stream_uploads_to(self, directory):
+        """Write file parts parsed from now on into temporary files in *directory*."""
+        self.upload_dir=directory; self.upload_parts=[]
+    def discard_upload_parts(self):
+        for name in getattr(self,'upload_parts',()):
+            try: os.remove(name)
+            except FileNotFoundError: pass
+
+def commit_upload(part, dest):
+    """Atomically move an uploaded part written by PanelRequest to *dest*."""
+    t0=time.perf_counter()
+    part.stream.flush(); os.fsync(part.stream.fileno())
+    UPLOAD_WRITE_SECONDS.observe(part.stream.write_time+time.perf_counter()-t0)
+    os.chmod(part.stream.name,0o666&~_UMASK)
+    os.replace(part.stream.name,dest)
+    part.stream.close()
+
+app = Flask(__name__, static_folder=None)
+app.request_class = PanelRequest
 app.secret_key = CONFIG["secret_key"]
 
-USERNAME = CONFIG["login"]
-PASSWORD = CONFIG["password"]
+# --- Metrics ---
+# Counters, gauges and histograms kept in memory and exposed at /metrics in the
+# Prometheus text format. Recording one is a lock, a bisect and an add; the
+# text is only built when /metrics is scraped. MetricsMiddleware times every
+# request per endpoint, from the call into Flask until the response body is
+# closed (so streamed pages count in full), and counts bytes in and out.
+METRIC_BUCKETS = (.001,.0025,.005,.01,.025,.05,.1,.25,.5,1,2.5,5,10,30)
+TEMPLATE_CHUNK = 8192
+METRICS = []
+
+def _label_value(v):
+    return str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+class Metric:
+    kind = 'untyped'
+    def __init__(self, name, help, labels=()):
+        self.name=name; self.help=help; self.labels=labels
+        self.lock=threading.Lock(); self.values={}
+        METRICS.append(self)
+    def _labels(self, key, extra=''):
+        pairs=[f'{n}="{_label_value(v)}"' for n,v in zip(self.labels,key)]
+        if extra: pairs.append(extra)
+        return '{'+','.join(pairs)+'}' if pairs else ''
+    def samples(self):
+        with self.lock: items=sorted(self.values.items())
+        for key,v in items: yield self.name+self._labels(key),v
+    def render(self):
+        lines=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} {self.kind}"]
+        lines+=[f"{name} {v:g}" if isinstance(v,float) else f"{name} {v}" for name,v in self.samples()]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+    def inc(self, amount=1, *labels):
+        with self.lock: self.values[labels]=self.values.get(labels,0)+amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+    def inc(self, amount=1, *labels):
+        with self.lock: self.values[labels]=self.values.get(labels,0)+amount
+    def dec(self, amount=1, *labels): self.inc(-amount,*labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+    def __init__(self, name, help, labels=(), buckets=METRIC_BUCKETS):
+        super().__init__(name,help,labels); self.buckets=buckets
+    def observe(self, value, *labels):
+        i=bisect_left(self.buckets,value)
+        with self.lock:
+            h=self.values.get(labels)
+            if h is None: h=self.values[labels]=[[0]*(len(self.buckets)+1),0.0]
+            h[0][i]+=1; h[1]+=value
+    @contextmanager
+    def time(self, *labels):
+        t0=time.perf_counter()
+        try: yield
+        finally: self.observe(time.perf_counter()-t0,*labels)
+    def samples(self):
+        with self.lock: items=sorted((k,(list(c),s)) for k,(c,s) in self.values.items())
+        for key,(counts,total) in items:
+            n=0
+            for bound,c in zip(self.buckets+(float('inf'),),counts):
+                n+=c
+                yield self.name+'_bucket'+self._labels(key,f'le="{"+Inf" if bound==float("inf") else f"{bound:g}"}"'),n
+            yield self.name+'_sum'+self._labels(key),total
+            yield self.name+'_count'+self._labels(key),n
+
+REQUEST_SECONDS = Histogram('panel_request_duration_seconds','Time from receiving a request until its response was fully sent.',('endpoint',))
+REQUESTS = Counter('panel_requests_total','Requests handled, by endpoint and status code.',('endpoint','code'))
+BYTES_IN = Counter('panel_received_bytes_total','Request body bytes received.')
+BYTES_OUT = Counter('panel_sent_bytes_total','Response body bytes sent.')
+ACTIVE_TRANSFERS = Gauge('panel_active_transfers','Uploads, downloads and archive downloads in progress.')
+LISTING_SCAN_SECONDS = Histogram('panel_listing_scan_seconds','Time to scandir() and stat() one folder for a listing.')
+TEMPLATE_SECONDS = Histogram('panel_template_render_seconds','Time spent rendering a template (streamed pages: generating only).',('template',))
+COMMAND_SECONDS = Histogram('panel_command_duration_seconds','Run time of external commands (vcgencmd, nvme).',('command',))
+UPLOAD_WRITE_SECONDS = Histogram('panel_upload_write_seconds','Time spent writing and syncing one uploaded file or chunk to disk.')
+ACTIVE_TRANSFERS.inc(0)
+
+def render_metrics():
+    return "\n".join(m.render() for m in METRICS)+"\n"
+
+@contextmanager
+def active_transfer():
+    ACTIVE_TRANSFERS.inc()
+    try: yield
+    finally: ACTIVE_TRANSFERS.dec()
+
+class TransferFile(io.FileIO):
+    """A file being downloaded; it counts as an active transfer until closed,
+    whether it is streamed by the panel or handed to the server's sendfile."""
+    def __init__(self, path):
+        super().__init__(path,'rb')
+        self._active=True; ACTIVE_TRANSFERS.inc()
+    def close(self):
+        if getattr(self,'_active',False):
+            self._active=False; ACTIVE_TRANSFERS.dec()
+        super().close()
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        with TEMPLATE_SECONDS.time(self.name):
+            return super().render(*args,**kwargs)
+    def generate(self, *args, **kwargs):
+        # Jinja yields every literal and expression separately; they are passed
+        # on in TEMPLATE_CHUNK pieces, and only the time spent producing them
+        # counts, not the time spent waiting for the client.
+        it=super().generate(*args,**kwargs); spent=0.0; buf=[]; size=0
+        try:
+            t0=time.perf_counter()
+            for piece in it:
+                buf.append(piece); size+=len(piece)
+                if size>=TEMPLATE_CHUNK:
+                    spent+=time.perf_counter()-t0
+                    yield ''.join(buf); buf=[]; size=0
+                    t0=time.perf_counter()
+            spent+=time.perf_counter()-t0
+            if buf: yield ''.join(buf)
+        finally:
+            it.close()
+            TEMPLATE_SECONDS.observe(spent,self.name)
+
+def run_command(args, **kwargs):
+    """subprocess.check_output(), timed under the command's name."""
+    name=args[1] if args[0]=='sudo' else args[0]
+    with COMMAND_SECONDS.time(name):
+        return subprocess.check_output(args,**kwargs)
+
+class _MeteredBody:
+    def __init__(self, body, done):
+        self.body=body; self.done=done; self.sent=0
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent+=len(chunk)
+            yield chunk
+    def close(self):
+        try:
+            if hasattr(self.body,'close'): self.body.close()
+        finally:
+            self.done(self.sent)
+
+class MetricsMiddleware:
+    def __init__(self, wsgi_app):
+        self.wsgi_app=wsgi_app
+    def __call__(self, environ, start_response):
+        t0=time.perf_counter(); resp={}
+        try: BYTES_IN.inc(int(environ.get('CONTENT_LENGTH') or 0))
+        except ValueError: pass
+        def start(status, headers, exc_info=None):
+            resp['code']=status[:3]; resp['headers']=headers
+            return start_response(status,headers,exc_info)
+        def done(sent):
+            endpoint=environ.get('panel.endpoint') or 'other'
+            REQUESTS.inc(1,endpoint,resp.get('code','500'))
+            BYTES_OUT.inc(sent)
+            # Event streams stay open for as long as a dashboard does.
+            if not any(k.lower()=='content-type' and v.startswith('text/event-stream') for k,v in resp.get('headers',())):
+                REQUEST_SECONDS.observe(time.perf_counter()-t0,endpoint)
+        body=self.wsgi_app(environ,start)
+        wrapper=environ.get('wsgi.file_wrapper')
+        if isinstance(wrapper,type) and isinstance(body,wrapper):
+            # Left unwrapped so the server can still use sendfile().
+            length=next((v for k,v in resp.get('headers',()) if k.lower()=='content-length'),'0')
+            done(int(length)); return body
+        return _MeteredBody(body,done)
+
+app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+@app.before_request
+def tag_endpoint():
+    request.environ['panel.endpoint']=request.endpoint
+
+# --- Templates ---
+# Pages live in templates/ and are compiled once when the module loads; the
+# compiled bytecode is also cached on disk so the first request after a reboot
+# does not pay for compilation either. The cache is unmarshalled, so it has to
+# be private: with no directory given, Jinja uses _jinja2-cache-<uid> in
+# TEMP_DIR, created 0700 and refused if another user owns it.
+if CONFIG.get("template_cache",True):
+    try:
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache':FileSystemBytecodeCache()}
+    except RuntimeError as e:
+        app.logger.warning("Template cache disabled: %s",e)
+app.jinja_env.template_class = TimedTemplate
+
+try:
+    from flask import stream_template
+except ImportError:
+    # Flask < 2.2
+    def stream_template(template_name, **context):
+        app.update_template_context(context)
+        return stream_with_context(app.jinja_env.get_template(template_name).generate(context))
+
 BASE_DIR = os.path.abspath("/home/pi/RetroPie")
 
 def format_datetime(v):
@@ -92,6 +503,140 @@ def format_filesize(v):
 app.jinja_env.filters['datetimeformat'] = format_datetime
 app.jinja_env.filters['filesizeformat'] = format_filesize
 
+# --- Static assets ---
+# CSS/JS/fonts ship in static/ so pages never wait for a CDN. Each file is
+# served under a content-hashed name (bootstrap.min.<hash>.css) with a one-year
+# immutable Cache-Control, so browsers only fetch it again after it changes.
+# gzip (and brotli, if the module is installed) variants are produced once and
+# kept in a private TEMP_DIR/assets, so a restart skips brotli's slowest
+# setting; everything is held in memory, as the bundle is small. A cached
+# variant is only used if it decompresses to the current file.
+STATIC_DIR = os.path.join(app.root_path, "static")
+ASSET_CACHE_DIR = os.path.join(TEMP_DIR, "assets")
+ASSET_TYPES = ('.css','.js','.woff','.woff2','.svg','.png','.ico')
+_asset_names={}
+_assets={}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def _precompressed(digest, data, encoding, compress, decompress):
+    try: private_dir(ASSET_CACHE_DIR)
+    except OSError: return compress(data)
+    path=os.path.join(ASSET_CACHE_DIR,f"{digest}.{encoding}")
+    try:
+        with open(path,'rb') as f: out=f.read()
+        if decompress(out)==data: return out
+    except Exception:
+        pass
+    out=compress(data)
+    try:
+        with open(path+'.tmp','wb') as f: f.write(out)
+        os.replace(path+'.tmp',path)
+    except OSError:
+        pass
+    return out
+
+def load_assets():
+    for root,_,files in os.walk(STATIC_DIR):
+        for fn in files:
+            if not fn.endswith(ASSET_TYPES): continue
+            full=os.path.join(root,fn)
+            name=os.path.relpath(full,STATIC_DIR).replace(os.sep,'/')
+            with open(full,'rb') as f: data=f.read()
+            digest=hashlib.sha256(data).hexdigest()[:16]
+            stem,ext=posixpath.splitext(name)
+            hashed=f"{stem}.{digest[:10]}{ext}"
+            variants={'identity':data}
+            if ext in ('.css','.js','.svg'):
+                variants['gzip']=_precompressed(digest,data,'gz',lambda d:gzip.compress(d,9,mtime=0),gzip.decompress)
+                if brotli is not None:
+                    variants['br']=_precompressed(digest,data,'br',lambda d:brotli.compress(d,quality=11),brotli.decompress)
+            _asset_names[name]=hashed
+            _assets[hashed]=(variants,mimetypes.guess_type(fn)[0] or 'application/octet-stream',f'"{digest}"')
+
+def asset_url(name):
+    return url_for('asset',name=_asset_names[name])
+
+@app.route('/assets/<path:name>')
+def asset(name):
+    if name not in _assets: abort(404)
+    variants,mimetype,etag=_assets[name]
+    headers={'Cache-Control':'public, max-age=31536000, immutable','ETag':etag,'Vary':'Accept-Encoding'}
+    if request.headers.get('If-None-Match')==etag:
+        return Response(status=304,headers=headers)
+    encoding='identity'
+    for enc in ('br','gzip'):
+        if enc in variants and request.accept_encodings[enc]:
+            encoding=enc; break
+    if encoding!='identity': headers['Content-Encoding']=encoding
+    return Response(variants[encoding],mimetype=mimetype,headers=headers)
+
+# --- Response compression ---
+# HTML and JSON bodies are compressed with brotli or gzip, whichever the client
+# accepts (brotli only if the module is installed). Bodies smaller than
+# compress_min_size are sent as-is, as the saving would not cover the overhead.
+# Streamed pages are compressed on the fly and flushed every COMPRESS_FLUSH
+# bytes of input, so the browser still renders the table while it arrives.
+# Downloads, archives and the SSE stream are never touched.
+COMPRESS_TYPES = ('text/html','application/json')
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 4
+COMPRESS_FLUSH = 16384
+
+def _compressor(encoding):
+    """Return (compress, flush, finish) callables for a streaming encoder."""
+    if encoding=='br':
+        c=brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process,c.flush,c.finish
+    c=zlib.compressobj(COMPRESS_LEVEL,zlib.DEFLATED,31)
+    return c.compress,(lambda:c.flush(zlib.Z_SYNC_FLUSH)),c.flush
+
+def _compress_stream(chunks, encoding):
+    compress,flush,finish=_compressor(encoding)
+    pending=0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk,str): chunk=chunk.encode()
+            out=compress(chunk); pending+=len(chunk)
+            if pending>=COMPRESS_FLUSH:
+                out+=flush(); pending=0
+            if out: yield out
+        yield finish()
+    finally:
+        if hasattr(chunks,'close'): chunks.close()
+
+@app.after_request
+def compress_response(resp):
+    if (resp.mimetype not in COMPRESS_TYPES or resp.direct_passthrough
+            or 'Content-Encoding' in resp.headers):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    if request.method=='HEAD' or resp.status_code!=200:
+        return resp
+    if brotli is not None and request.accept_encodings['br']: encoding='br'
+    elif request.accept_encodings['gzip']: encoding='gzip'
+    else: return resp
+    if resp.is_streamed:
+        resp.response=_compress_stream(resp.response,encoding)
+        resp.headers.pop('Content-Length',None)
+    else:
+        data=resp.get_data()
+        if len(data)<CONFIG.get("compress_min_size",1024):
+            return resp
+        if encoding=='br': data=brotli.compress(data,quality=BROTLI_QUALITY)
+        else: data=gzip.compress(data,COMPRESS_LEVEL)
+        resp.set_data(data)
+    resp.headers['Content-Encoding']=encoding
+    return resp
+
+load_assets()
+app.jinja_env.globals['asset_url'] = asset_url
+for _name in app.jinja_env.list_templates(extensions=['html']):
+    app.jinja_env.get_template(_name)
+
 def check_auth(u,p): return u==CONFIG["login"] and p==CONFIG["password"]
 def authenticate():
     return Response('Access denied\n',401,{'WWW-Authenticate':'Basic realm="Login Required"'})
@@ -110,24 +655,659 @@ def safe_path(path):
         abort(403)
     return abs_path
 
+# --- Directory listing cache ---
+# Listings are built with a single os.scandir() pass (one stat per entry) and
+# cached per directory, keyed on the directory's own mtime, so re-listing an
+# unchanged folder costs a single stat. Handlers that change a directory also
+# invalidate it explicitly, because overwriting a file in place does not bump
+# the directory mtime and FAT/exFAT only store it with 2 s resolution.
+LISTING_CACHE_SIZE = 64
+_listing_cache=OrderedDict()
+_listing_lock=threading.Lock()
+
+def rel_path(abs_path):
+    rel=os.path.relpath(abs_path,BASE_DIR)
+    return '' if rel=='.' else rel.replace(os.sep,'/')
+
+def scan_directory(path):
+    rel=rel_path(path); files=[]
+    with LISTING_SCAN_SECONDS.time(), os.scandir(path) as it:
+        for e in it:
+            if e.name.startswith(UPLOAD_PART_PREFIX): continue
+            try: st=e.stat()
+            except OSError: continue
+            is_dir=stat.S_ISDIR(st.st_mode)
+            files.append({
+                'name':e.name,
+                'path':posixpath.join(rel,e.name) if rel else e.name,
+                'is_dir':is_dir,
+                'mtime':st.st_mtime,
+                'size':st.st_size if stat.S_ISREG(st.st_mode) else None,
+                'file_type':'folder' if is_dir else os.path.splitext(e.name)[1].lower()
+            })
+    return files
+
+def _listing_entry(path):
+    key=os.stat(path).st_mtime_ns
+    with _listing_lock:
+        hit=_listing_cache.get(path)
+        if hit and hit[0]==key:
+            _listing_cache.move_to_end(path)
+            return hit
+    hit=(key,scan_directory(path),{})
+    with _listing_lock:
+        _listing_cache[path]=hit
+        _listing_cache.move_to_end(path)
+        while len(_listing_cache)>LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return hit
+
+def get_listing(path):
+    """Return the cached entries of directory *path*. The list is shared between requests; do not mutate it."""
+    return _listing_entry(path)[1]
+
+SORT_KEYS = {
+    'name':lambda x:x['name'].lower(),
+    'date':lambda x:x['mtime'],
+    'type':lambda x:(x['file_type'],x['name'].lower()),
+    'size':lambda x:entry_size(x) or 0,
+}
+
+LISTING_VIEW_VERSIONS = 4
+_view_ids=itertools.count(1)
+
+def sorted_view(path, sort='name', order='asc', version=None):
+    """(version, files) for *path* sorted by one of SORT_KEYS; each ordering is sorted once per cached listing."""
+    if sort not in SORT_KEYS: sort='name'
+    _,files,views=_listing_entry(path)
+    view=(sort,order=='desc')
+    # Size order depends on folder sizes that arrive in the background, so it is
+    # re-sorted when a folder in this listing changes size. The last few orders
+    # stay available by version, so pages fetched while scrolling continue the
+    # order the first page was cut from.
+    # views is shared by every request for this folder; it is only read or
+    # changed under _listing_lock, the sorting itself happens outside it.
+    sizes=tuple(entry_size(f) for f in files if f['is_dir']) if sort=='size' else None
+    with _listing_lock:
+        hit=views.get(view)
+    if hit is None or hit[1]!=sizes:
+        ordered=sorted(files,key=SORT_KEYS[sort],reverse=view[1])
+        with _listing_lock:
+            hit=views.get(view)
+            if hit is None or hit[1]!=sizes:
+                hit=views[view]=(next(_view_ids),sizes,ordered)
+                views[view+(hit[0],)]=ordered
+                for old in [k for k in views if len(k)==3 and k[:2]==view and k[2]<=hit[0]-LISTING_VIEW_VERSIONS]:
+                    del views[old]
+    if version is not None and version!=hit[0]:
+        with _listing_lock:
+            old=views.get(view+(version,))
+        if old is not None: return version,old
+    return hit[0],hit[2]
+
+def get_sorted_listing(path, sort='name', order='asc'):
+    """Like get_listing(), sorted by one of SORT_KEYS."""
+    return sorted_view(path,sort,order)[1]
+
+def invalidate_listing(path):
+    with _listing_lock:
+        _listing_cache.pop(path,None)
+        _listing_versions[path]=next(_listing_version_ids)
+
+# Listing pages and /api/list pages carry a weak ETag built from the folder's
+# mtime and the query string (sort, order, offset, view, sensor), plus what
+# else they show of this folder: its version (bumped by explicit invalidations)
+# and the sizes of its subfolders, along with config changes and a restart.
+# Changes elsewhere, such as folder sizes computed in other branches, leave it
+# alone. A revalidation with a matching If-None-Match is answered with 304
+# from the cached listing, after a single stat() of the folder.
+_listing_versions={}
+_listing_version_ids=itertools.count(1)
+_boot_id=uuid.uuid4().hex[:8]
+
+def listing_etag(path, st=None):
+    st=st or os.stat(path)
+    try: files=get_listing(path)
+    except OSError: files=()
+    sizes=','.join(str(entry_size(f)) for f in files if f['is_dir'])
+    with _listing_lock: version=_listing_versions.get(path,0)
+    key=f"{st.st_mtime_ns}:{version}:{sizes}:{request.full_path}:{CONFIG.version}:{_boot_id}"
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def tag_listing(resp, etag):
+    resp.set_etag(etag,weak=True)
+    resp.headers['Cache-Control']='private, no-cache'
+    return resp
+
+def mark_changed(path, removed=None):
+    """Called by every handler that modifies directory *path* under BASE_DIR; *removed* is a deleted child folder."""
+    invalidate_listing(path)
+    get_library().request_rescan(path)
+    sizes=get_folder_sizes()
+    if removed: sizes.forget(rel_path(removed))
+    sizes.invalidate(rel_path(path))
+
+# --- Folder size tree ---
+# Recursive folder sizes are computed by a background thread and cached per
+# folder. Computing a folder reuses the cached sizes of its subfolders, and a
+# change invalidates the folder and all its ancestors, which are then queued
+# again, so only the changed branch is ever re-walked.
+class FolderSizes(threading.Thread):
+    def __init__(self, root):
+        super().__init__(name="folder-sizes", daemon=True)
+        self.root=root
+        self.sizes={}
+        self.lock=threading.Lock()
+        self.queue=deque(); self.queued=set()
+        self.wake=threading.Event()
+        self.epoch=0
+    def get(self, rel):
+        return self.sizes.get(rel)
+    def request(self, rel):
+        with self.lock:
+            if rel in self.sizes or rel in self.queued: return
+            self.queued.add(rel); self.queue.append(rel)
+        self.wake.set()
+    def invalidate(self, rel):
+        requeue=[]
+        with self.lock:
+            while True:
+                if self.sizes.pop(rel,None) is not None: requeue.append(rel)
+                if not rel: break
+                rel=posixpath.dirname(rel)
+            self.epoch+=1
+        for r in requeue: self.request(r)
+    def forget(self, rel):
+        prefix=rel+'/'
+        with self.lock:
+            for k in [k for k in self.sizes if k==rel or k.startswith(prefix)]:
+                del self.sizes[k]
+            self.epoch+=1
+    def run(self):
+        while True:
+            self.wake.wait()
+            while True:
+                with self.lock:
+                    if not self.queue: self.wake.clear(); break
+                    rel=self.queue.popleft(); self.queued.discard(rel)
+                if rel in self.sizes: continue
+                try: self.compute(rel)
+                except OSError: pass
+                except Exception as e:
+                    # Anything else would end the thread and leave every folder "computing…".
+                    app.logger.warning("Folder size of %s failed: %s",rel or '/',e)
+    def _scan(self, rel):
+        """[rel, epoch, size of files and cached subfolders, subfolders still to walk]"""
+        epoch=self.epoch; total=0; subs=[]
+        with os.scandir(os.path.join(self.root,rel)) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        sub=posixpath.join(rel,e.name) if rel else e.name
+                        size=self.sizes.get(sub)
+                        if size is None: subs.append(sub)
+                        else: total+=size
+                    else:
+                        total+=e.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+        return [rel,epoch,total,subs]
+    def compute(self, rel):
+        # Depth-first with an explicit stack, so deep trees cannot hit the
+        # recursion limit; each folder is cached as soon as its subfolders are done.
+        stack=[self._scan(rel)]
+        while True:
+            frame=stack[-1]
+            if frame[3]:
+                try: stack.append(self._scan(frame[3].pop()))
+                except OSError: pass
+                continue
+            stack.pop()
+            sub,epoch,total,_=frame
+            with self.lock:
+                # A folder invalidated while it was being walked is queued again
+                # instead of caching a value that may already be out of date.
+                if epoch!=self.epoch:
+                    if sub not in self.queued: self.queued.add(sub); self.queue.append(sub)
+                else:
+                    self.sizes[sub]=total
+            if not stack: return total
+            stack[-1][2]+=total
+
+_folder_sizes=None
+_folder_sizes_lock=threading.Lock()
+
+def get_folder_sizes():
+    global _folder_sizes
+    if _folder_sizes is None:
+        with _folder_sizes_lock:
+            if _folder_sizes is None:
+                fs=FolderSizes(BASE_DIR)
+                fs.start()
+                _folder_sizes=fs
+    return _folder_sizes
+
+def request_folder_sizes(files):
+    sizes=get_folder_sizes()
+    for f in files:
+        if f['is_dir']: sizes.request(f['path'])
+
+def entry_size(f):
+    """Size of a listing entry: the file size, or the cached recursive size of a folder (None while computing)."""
+    if not f['is_dir']: return f['size']
+    return get_folder_sizes().get(f['path'])
+
+# --- ROM library index ---
+# A SQLite database mirrors every file under BASE_DIR. Rescans are incremental:
+# a directory whose mtime_ns matches the stored value still has the same
+# entries, so only its subdirectories are visited; changed directories are
+# re-listed with scandir and their rows replaced. An unchanged tree therefore
+# costs one stat per directory.
+LIBRARY_DB = os.path.join(os.path.dirname(CONFIG_FILE), "library.db")
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL,
+    size INTEGER NOT NULL, mtime REAL NOT NULL, ext TEXT NOT NULL, system TEXT);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS files_system ON files(system);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+CREATE INDEX IF NOT EXISTS files_size ON files(size);
+CREATE TABLE IF NOT EXISTS hashes (dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL, crc32 TEXT NOT NULL, md5 TEXT NOT NULL, sha1 TEXT NOT NULL, PRIMARY KEY (dev, ino));
+CREATE TABLE IF NOT EXISTS dats (id INTEGER PRIMARY KEY, name TEXT NOT NULL, description TEXT, version TEXT,
+    system TEXT, games INTEGER NOT NULL DEFAULT 0, roms INTEGER NOT NULL DEFAULT 0, added REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS dat_roms (dat INTEGER NOT NULL, game TEXT NOT NULL, name TEXT NOT NULL,
+    size INTEGER, crc32 TEXT, md5 TEXT, sha1 TEXT);
+CREATE INDEX IF NOT EXISTS dat_roms_crc ON dat_roms(dat, crc32, size);
+"""
+# Filename search uses an FTS5 trigram index over files.name, kept in sync by
+# triggers so the scanner needs no extra bookkeeping. Trigrams answer substring
+# queries of three or more characters; shorter ones fall back to LIKE.
+LIBRARY_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE files_fts USING fts5(name, content='files', content_rowid='rowid', tokenize='trigram');
+CREATE TRIGGER files_fts_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts(rowid,name) VALUES (new.rowid,new.name);
+END;
+CREATE TRIGGER files_fts_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts(files_fts,rowid,name) VALUES ('delete',old.rowid,old.name);
+END;
+INSERT INTO files_fts(files_fts) VALUES ('rebuild');
+"""
+SEARCH_PAGE_SIZE = 50
+
+def system_of(rel):
+    # roms/<system>/... is the EmulationStation layout; anything else has no system.
+    parts=rel.split('/')
+    return parts[1] if len(parts)>2 and parts[0]=='roms' else None
+
+def _in_subtree(rel, root):
+    return not root or rel==root or rel.startswith(root+'/')
+
+class LibraryIndex(threading.Thread):
+    def __init__(self, db_path, root, interval):
+        super().__init__(name="library-index", daemon=True)
+        self.db_path=db_path; self.root=root; self.interval=interval
+        self.local=threading.local()
+        self.scan_lock=threading.Lock()
+        self.pending_lock=threading.Lock()
+        self.pending={}
+        self.wake=threading.Event()
+        self.last_scan=None; self.last_duration=None; self.scanning=False
+        with self.connect() as c:
+            c.executescript(LIBRARY_SCHEMA)
+            self.fts=self._init_fts(c)
+    def _init_fts(self, c):
+        if c.execute("SELECT 1 FROM sqlite_master WHERE name='files_fts'").fetchone():
+            return True
+        try:
+            c.executescript("BEGIN;"+LIBRARY_FTS_SCHEMA+"COMMIT;")
+            return True
+        except sqlite3.OperationalError as e:
+            # SQLite older than 3.34 has no trigram tokenizer.
+            c.rollback()
+            app.logger.warning("Filename search index unavailable, using LIKE: %s",e)
+            return False
+    def connect(self):
+        # One connection per thread; WAL lets request threads read during a scan.
+        c=getattr(self.local,'conn',None)
+        if c is None:
+            c=sqlite3.connect(self.db_path,timeout=30)
+            c.execute("PRAGMA journal_mode=WAL"); c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("PRAGMA recursive_triggers=ON")
+            self.local.conn=c
+        return c
+    def request_rescan(self, abs_path=None):
+        rel=rel_path(abs_path) if abs_path else ''
+        with self.pending_lock: self.pending[rel]=True
+        self.wake.set()
+    def run(self):
+        self.scan()
+        while True:
+            self.wake.wait(self.interval if self.interval>0 else None)
+            self.wake.clear()
+            with self.pending_lock:
+                pending,self.pending=self.pending,{}
+            try:
+                if pending: self.scan(list(pending),force=pending)
+                else: self.scan()
+            except Exception as e:
+                app.logger.warning("Library scan failed: %s",e)
+    def scan(self, roots=('',), force=()):
+        """Bring the index up to date below *roots*; directories in *force* are re-listed even if unchanged."""
+        with self.scan_lock:
+            self.scanning=True; t0=time.time()
+            try:
+                self._scan(roots,force)
+            finally:
+                self.scanning=False; self.last_scan=time.time(); self.last_duration=time.time()-t0
+    def _scan(self, roots, force):
+        c=self.connect()
+        known={}; children={}
+        for path,parent,mtime_ns in c.execute("SELECT path,parent,mtime_ns FROM dirs"):
+            known[path]=mtime_ns
+            children.setdefault(parent,[]).append(path)
+        seen=set(); stack=list(roots); batch=0
+        while stack:
+            rel=stack.pop()
+            if rel in seen: continue
+            seen.add(rel)
+            try: mtime_ns=os.stat(os.path.join(self.root,rel)).st_mtime_ns
+            except OSError: continue
+            if known.get(rel)==mtime_ns and rel not in force:
+                stack.extend(children.get(rel,())); continue
+            try:
+                with os.scandir(os.path.join(self.root,rel)) as it: entries=list(it)
+            except OSError:
+                stack.extend(children.get(rel,())); continue
+            rows=[]; subdirs=[]
+            for e in entries:
+                if e.name.startswith(UPLOAD_PART_PREFIX): continue
+                sub=posixpath.join(rel,e.name) if rel else e.name
+                try:
+                    if e.is_dir(follow_symlinks=False): subdirs.append(sub); continue
+                    st=e.stat()
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    rows.append((sub,rel,e.name,st.st_size,st.st_mtime,os.path.splitext(e.name)[1].lower(),system_of(sub)))
+            if rel in known: get_folder_sizes().invalidate(rel)
+            c.execute("DELETE FROM files WHERE dir=?",(rel,))
+            c.executemany("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)",rows)
+            c.execute("INSERT OR REPLACE INTO dirs VALUES (?,?,?)",(rel,posixpath.dirname(rel) if rel else None,mtime_ns))
+            stack.extend(subdirs)
+            batch+=1
+            if batch%200==0: c.commit()
+        stale=[(d,) for d in known if d not in seen and any(_in_subtree(d,r) for r in roots)]
+        c.executemany("DELETE FROM files WHERE dir=?",stale)
+        c.executemany("DELETE FROM dirs WHERE path=?",stale)
+        c.commit()
+    def search(self, q, prefix=False, system=None, offset=0, limit=SEARCH_PAGE_SIZE):
+        """Find files whose name contains *q* (or starts with it, if *prefix*); returns (total, rows)."""
+        c=self.connect()
+        like=q.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')
+        like=(like if prefix else '%'+like)+'%'
+        if self.fts and len(q)>=3:
+            src="files_fts JOIN files f ON f.rowid=files_fts.rowid"
+            where=["files_fts MATCH ?"]; args=['"'+q.replace('"','""')+'"']
+            if prefix: where.append("f.name LIKE ? ESCAPE '\\'"); args.append(like)
+        else:
+            src="files f"; where=["f.name LIKE ? ESCAPE '\\'"]; args=[like]
+        if system:
+            where.append("f.system=?"); args.append(system)
+        cond=" AND ".join(where)
+        total=c.execute(f"SELECT COUNT(*) FROM {src} WHERE {cond}",args).fetchone()[0]
+        rows=c.execute(f"SELECT f.path,f.name,f.size,f.mtime,f.ext,f.system FROM {src} WHERE {cond} "
+                       "ORDER BY f.name COLLATE NOCASE LIMIT ? OFFSET ?",args+[limit,offset]).fetchall()
+        return total,[{'path':r[0],'name':r[1],'size':r[2],'mtime':r[3],'file_type':r[4],'system':r[5]} for r in rows]
+    @staticmethod
+    def _subtree(root):
+        # SQL condition (and its arguments) restricting files.path to below *root*.
+        if not root: return "",[]
+        return " AND path LIKE ? ESCAPE '\\'",[root.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')+'/%']
+    def files_under(self, root=''):
+        scope,args=self._subtree(root)
+        return self.connect().execute(f"SELECT path,size FROM files WHERE 1{scope} ORDER BY path",args).fetchall()
+    def size_candidates(self, root='', min_size=1):
+        """Paths of files below *root* whose size is shared by at least one other file there."""
+        scope,args=self._subtree(root)
+        return self.connect().execute(
+            f"SELECT path,size FROM files WHERE size>=?{scope} AND size IN "
+            f"(SELECT size FROM files WHERE size>=?{scope} GROUP BY size HAVING COUNT(*)>1) ORDER BY size DESC",
+            [min_size]+args+[min_size]+args).fetchall()
+    def cached_hash(self, st):
+        """(crc32, md5, sha1) of the file behind stat result *st*, if it is unchanged since it was hashed."""
+        return self.connect().execute(
+            "SELECT crc32,md5,sha1 FROM hashes WHERE dev=? AND ino=? AND size=? AND mtime_ns=?",
+            (st.st_dev,st.st_ino,st.st_size,st.st_mtime_ns)).fetchone()
+    def store_hash(self, st, digests):
+        c=self.connect()
+        c.execute("INSERT OR REPLACE INTO hashes VALUES (?,?,?,?,?,?,?)",
+                  (st.st_dev,st.st_ino,st.st_size,st.st_mtime_ns)+tuple(digests))
+        c.commit()
+    def stats(self, top=10):
+        c=self.connect()
+        files,size=c.execute("SELECT COUNT(*),COALESCE(SUM(size),0) FROM files").fetchone()
+        dirs=c.execute("SELECT COUNT(*) FROM dirs").fetchone()[0]
+        systems=[{'system':r[0],'files':r[1],'bytes':r[2]} for r in c.execute(
+            "SELECT system,COUNT(*),SUM(size) FROM files WHERE system IS NOT NULL GROUP BY system ORDER BY 3 DESC")]
+        folders=[{'path':r[0],'files':r[1],'bytes':r[2]} for r in c.execute(
+            "SELECT dir,COUNT(*),SUM(size) FROM files GROUP BY dir ORDER BY 3 DESC LIMIT ?",(top,))]
+        extensions=[{'ext':r[0],'files':r[1],'bytes':r[2]} for r in c.execute(
+            "SELECT ext,COUNT(*),SUM(size) FROM files GROUP BY ext ORDER BY 3 DESC LIMIT ?",(top,))]
+        return {
+            'files':files,'bytes':size,'dirs':dirs,
+            'systems':systems,'largest_folders':folders,'extensions':extensions,
+            'scanning':self.scanning,'last_scan':self.last_scan,'last_scan_seconds':self.last_duration
+        }
+
+_library=None
+_library_lock=threading.Lock()
+
+def get_library():
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                lib=LibraryIndex(LIBRARY_DB,BASE_DIR,CONFIG.get("index_interval",600))
+                lib.start()
+                _library=lib
+    return _library
+
+@app.before_request
+def start_library_index():
+    get_library()
+
+@app.before_request
+def start_config_watcher():
+    CONFIG.watch()
+
+# --- Content hashes ---
+# CRC32, MD5 and SHA1 (the digests DAT files use) are computed in one pass over
+# each file, through a sliding mmap window so large images also fit a 32-bit
+# address space. hashlib and zlib release the GIL on large buffers, so a pool
+# of hash_workers threads hashes several files in parallel. Results are cached
+# in library.db keyed by (device, inode) and are only reused while size and
+# mtime still match, so renamed or moved files keep their hashes. Duplicate
+# detection only hashes files whose size matches another file.
+HASH_WINDOW = 64*1024*1024
+HASH_BLOCK = 4*1024*1024
+
+def hash_file(path):
+    """Return the (crc32, md5, sha1) hex digests of *path*."""
+    crc=0; md5=hashlib.md5(); sha1=hashlib.sha1()
+    with open(path,'rb') as f:
+        size=os.fstat(f.fileno()).st_size
+        for start in range(0,size,HASH_WINDOW):
+            with mmap.mmap(f.fileno(),min(HASH_WINDOW,size-start),access=mmap.ACCESS_READ,offset=start) as m:
+                if hasattr(m,'madvise'): m.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(m) as view:
+                    for off in range(0,len(view),HASH_BLOCK):
+                        with view[off:off+HASH_BLOCK] as block:
+                            crc=zlib.crc32(block,crc); md5.update(block); sha1.update(block)
+    return f"{crc:08x}",md5.hexdigest(),sha1.hexdigest()
+
+def hash_files(paths, job=None):
+    """Return {path: (crc32, md5, sha1)} for the regular files among absolute *paths*,
+    hashing only those missing from the cache. With a *job*, progress and errors
+    are reported on it and cancellation is honoured."""
+    lib=get_library(); out={}; todo={}
+    for p in paths:
+        try: st=os.stat(p)
+        except OSError: continue
+        if not stat.S_ISREG(st.st_mode): continue
+        hit=lib.cached_hash(st)
+        if hit: out[p]=tuple(hit)
+        else: todo.setdefault((st.st_dev,st.st_ino),[]).append((p,st))
+    if job:
+        job.items_total+=len(todo); job.bytes_total+=sum(v[0][1].st_size for v in todo.values())
+    pool=ThreadPoolExecutor(max(1,CONFIG.get("hash_workers",2)),thread_name_prefix="hash")
+    try:
+        futures={pool.submit(hash_file,v[0][0]):v for v in todo.values()}
+        for fut in as_completed(futures):
+            links=futures[fut]; p,st=links[0]
+            try: digests=fut.result()
+            except OSError as e:
+                if job: job.errors.append(f"{rel_path(p)}: {e.strerror or e}")
+                continue
+            lib.store_hash(st,digests)
+            for lp,_ in links: out[lp]=digests
+            if job:
+                job.current=p; job.items_done+=1; job.bytes_done+=st.st_size
+                job.check()
+    finally:
+        pool.shutdown(wait=True,cancel_futures=True)
+    return out
+
+def duplicate_report(root='', min_size=1):
+    """Group the already-hashed same-size files below *root* into duplicate sets.
+    Hard links to one inode count as a single copy, as deleting them frees nothing."""
+    lib=get_library(); groups={}; unhashed=0
+    for path,size in lib.size_candidates(root,min_size):
+        try: st=os.stat(os.path.join(BASE_DIR,path))
+        except OSError: continue
+        h=lib.cached_hash(st)
+        if h is None: unhashed+=1; continue
+        groups.setdefault((st.st_size,)+tuple(h),{}).setdefault((st.st_dev,st.st_ino),[]).append(path)
+    sets=[]
+    for (size,crc,md5,sha1),inodes in groups.items():
+        if len(inodes)<2: continue
+        sets.append({'size':size,'crc32':crc,'md5':md5,'sha1':sha1,'copies':len(inodes),
+                     'reclaimable':size*(len(inodes)-1),
+                     'files':sorted(p for paths in inodes.values() for p in paths)})
+    sets.sort(key=lambda d:d['reclaimable'],reverse=True)
+    return {'path':root,'sets':sets,'reclaimable':sum(d['reclaimable'] for d in sets),'unhashed':unhashed}
+
 def round_1(x): return round(x,1)
-def get_cpu_temp():
+
+# --- Native sensor readers ---
+# Temperatures come straight from sysfs. Each attribute file is opened once and
+# re-read with pread() at offset 0, which makes the kernel regenerate its value,
+# so a sample costs one syscall per sensor instead of a fork/exec of vcgencmd or
+# nvme-cli. The command-line tools are only used when sensor_fallback=True.
+THERMAL_ROOT = "/sys/class/thermal"
+HWMON_ROOT = "/sys/class/hwmon"
+
+class SysfsSensor:
+    def __init__(self, path):
+        self.path=path; self.fd=None
+    def read_text(self):
+        if self.fd is None:
+            self.fd=os.open(self.path,os.O_RDONLY)
+        try:
+            return os.pread(self.fd,32,0).decode().strip()
+        except OSError:
+            self.close(); raise
+    def read_millideg(self):
+        try:
+            return int(self.read_text())
+        except ValueError:
+            self.close(); raise
+    def read_celsius(self):
+        return self.read_millideg()/1000
+    def close(self):
+        if self.fd is not None:
+            try: os.close(self.fd)
+            except OSError: pass
+            self.fd=None
+
+def _read_attr(path):
     try:
-        t = subprocess.check_output(['vcgencmd','measure_temp']).decode().strip()
-        return t.split('=')[1].split("'")[0]+"°C"
-    except:
+        with open(path) as f: return f.read().strip()
+    except OSError:
+        return ""
+
+def _hwmon_dirs(name):
+    try: entries=sorted(os.listdir(HWMON_ROOT))
+    except OSError: return []
+    return [os.path.join(HWMON_ROOT,e) for e in entries if _read_attr(os.path.join(HWMON_ROOT,e,"name"))==name]
+
+def find_cpu_sensor():
+    zones=[]
+    try: zones=sorted(e for e in os.listdir(THERMAL_ROOT) if e.startswith("thermal_zone"))
+    except OSError: pass
+    for z in zones:
+        if "cpu" in _read_attr(os.path.join(THERMAL_ROOT,z,"type")).lower():
+            return SysfsSensor(os.path.join(THERMAL_ROOT,z,"temp"))
+    for d in _hwmon_dirs("cpu_thermal"):
+        return SysfsSensor(os.path.join(d,"temp1_input"))
+    if zones:
+        return SysfsSensor(os.path.join(THERMAL_ROOT,zones[0],"temp"))
+    return None
+
+def find_nvme_sensors():
+    # Labels are mapped to the names nvme-cli prints so saved ssd_sensor values keep working.
+    sensors={}
+    for d in _hwmon_dirs("nvme")[:1]:
+        inputs=sorted((f for f in os.listdir(d) if f.startswith("temp") and f.endswith("_input")),
+                      key=lambda f:int(f[4:-6]) if f[4:-6].isdigit() else 0)
+        for f in inputs:
+            label=_read_attr(os.path.join(d,f[:-6]+"_label"))
+            if not label or label=="Composite": name="temperature"
+            elif label.startswith("Sensor "): name="Temperature "+label
+            else: name=label
+            sensors[name]=SysfsSensor(os.path.join(d,f))
+    return sensors
+
+# Discovered sensors, keyed "cpu"/"nvme"/"throttled"; an entry is dropped (and rediscovered
+# on the next sample) when a read fails, e.g. after a driver reload.
+_sensors={}
+
+def _forget_sensors(key):
+    found=_sensors.pop(key,None)
+    for sensor in (found.values() if isinstance(found,dict) else [found]):
+        if sensor is not None: sensor.close()
+
+def _fmt_temp(v): return f"{round(v,1)}°C"
+
+def get_cpu_temp():
+    if "cpu" not in _sensors:
+        _sensors["cpu"]=find_cpu_sensor()
+    if _sensors["cpu"] is not None:
+        try: return _fmt_temp(_sensors["cpu"].read_celsius())
+        except (OSError,ValueError): _forget_sensors("cpu")
+    if CONFIG.get("sensor_fallback"):
         try:
-            with open("/sys/class/thermal/thermal_zone0/temp") as f:
-                v = float(f.read().strip())/1000
-                return f"{round(v,1)}°C"
+            t = run_command(['vcgencmd','measure_temp']).decode().strip()
+            return t.split('=')[1].split("'")[0]+"°C"
         except:
-            return "N/A"
+            pass
+    return "N/A"
+
 def get_ssd_temperatures():
     if not CONFIG.get("show_nvme"): return {}
+    if "nvme" not in _sensors:
+        _sensors["nvme"]=find_nvme_sensors()
     sensors={}
     try:
-        out = subprocess.check_output(["sudo","nvme","smart-log","/dev/nvme0"],
-                                      stderr=subprocess.STDOUT,universal_newlines=True)
+        for name,sensor in _sensors["nvme"].items():
+            sensors[name]=_fmt_temp(sensor.read_celsius())
+    except (OSError,ValueError):
+        _forget_sensors("nvme"); sensors={}
+    if sensors or not CONFIG.get("sensor_fallback"):
+        return sensors
+    try:
+        out = run_command(["sudo","nvme","smart-log","/dev/nvme0"],
+                          stderr=subprocess.STDOUT,universal_newlines=True)
         for line in out.splitlines():
             if "temperature" in line.lower():
                 k,v=line.split(":",1)
@@ -137,20 +1317,30 @@ def get_ssd_temperatures():
         pass
     return sensors
 
-def get_monitoring_data(sensor=None):
-    if sensor is None: sensor=CONFIG.get("ssd_sensor")
+THROTTLED_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+def get_throttled():
+    """Current Raspberry Pi firmware throttling flags, or None where unavailable:
+    bit 0 under-voltage, 1 ARM frequency capped, 2 throttled, 3 soft temperature limit."""
+    if "throttled" not in _sensors:
+        _sensors["throttled"]=SysfsSensor(THROTTLED_PATH) if os.path.exists(THROTTLED_PATH) else None
+    if _sensors["throttled"] is not None:
+        try: return int(_sensors["throttled"].read_text(),16)&0xf
+        except (OSError,ValueError): _forget_sensors("throttled")
+    if CONFIG.get("sensor_fallback"):
+        try:
+            out=run_command(['vcgencmd','get_throttled']).decode().strip()
+            return int(out.split('=')[1],16)&0xf
+        except:
+            pass
+    return None
+
+def collect_monitoring_data():
     cpu_usage=round_1(psutil.cpu_percent(interval=0.0))
     mem=psutil.virtual_memory(); mem_percent=round_1(mem.percent)
     disk=psutil.disk_usage(BASE_DIR); disk_percent=round_1((disk.used/disk.total)*100 if disk.total>0 else 0)
     disk_free=disk.total-disk.used; cpu_temp=get_cpu_temp()
     ssd_temps=get_ssd_temperatures()
-    if not ssd_temps:
-        ssd_name,ssd_temp=None,"N/A"
-    else:
-        if sensor and sensor in ssd_temps:
-            ssd_name,ssd_temp=sensor,ssd_temps[sensor]
-        else:
-            ssd_name,ssd_temp=next(iter(ssd_temps.items()))
     try:
         freq=psutil.cpu_freq()
         cf_cur=round_1(freq.current) if freq else 0
@@ -165,16 +1355,249 @@ def get_monitoring_data(sensor=None):
         'cpu_freq_current':cf_cur,'cpu_freq_max':cf_max,
         'mem_total':mem.total,'mem_used':mem.used,'mem_percent':mem_percent,
         'disk_total':disk.total,'disk_used':disk.used,'disk_free':disk_free,'disk_percent':disk_percent,
-        'ssd_all':ssd_temps,'ssd_selected_name':ssd_name,'ssd_temp':ssd_temp,
-        'uptime':uptime
+        'ssd_all':ssd_temps,'uptime':uptime,'throttled':get_throttled()
     }
 
-@app.route('/api/monitoring')
-@requires_auth
-def api_monitoring():
-    sensor=request.args.get('ssd_sensor') or CONFIG.get("ssd_sensor")
+# --- Metrics history ---
+# Every sample is folded into three round-robin tiers: 1 s slots for an hour,
+# 1 min for a day and 15 min for a month. Each slot keeps min, max, sum and
+# count per metric in flat arrays (float32/uint16, slot-major), so memory is
+# fixed at about 0.9 MB whatever the uptime. history.rrd next to config.cfg
+# has the same layout: it is written in full once, after that only the slots
+# changed since the last save are rewritten in place every
+# HISTORY_SAVE_INTERVAL seconds and at exit, which keeps SD card writes small.
+HISTORY_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "history.rrd")
+HISTORY_METRICS = ('cpu_usage','cpu_temp','cpu_freq','mem_percent','disk_percent','ssd_temp','throttled')
+HISTORY_TIERS = ((1,3600),(60,1440),(900,2976))
+HISTORY_HEADER = 256
+HISTORY_SAVE_INTERVAL = 300
+HISTORY_MAX_POINTS = 1000
+
+class HistoryTier:
+    def __init__(self, step, slots, width):
+        self.step=step; self.slots=slots; self.width=width
+        self.stamp=array('q',[-1])*slots
+        self.min=array('f',[0])*(slots*width)
+        self.max=array('f',[0])*(slots*width)
+        self.sum=array('f',[0])*(slots*width)
+        self.count=array('H',[0])*(slots*width)
+        self.dirty=set()
+    def arrays(self):
+        # (array, items per slot) in file order.
+        return ((self.stamp,1),(self.min,self.width),(self.max,self.width),(self.sum,self.width),(self.count,self.width))
+    def nbytes(self):
+        return sum(a.itemsize*len(a) for a,_ in self.arrays())
+    def add(self, t, values):
+        period=int(t//self.step); i=period%self.slots; base=i*self.width
+        if self.stamp[i]!=period:
+            self.stamp[i]=period
+            for k in range(base,base+self.width): self.count[k]=0
+        for m,v in enumerate(values):
+            if v is None: continue
+            k=base+m; n=self.count[k]
+            if n==0: self.min[k]=self.max[k]=self.sum[k]=v
+            elif n<65535:
+                if v<self.min[k]: self.min[k]=v
+                if v>self.max[k]: self.max[k]=v
+                self.sum[k]+=v
+            else: continue
+            self.count[k]=n+1
+        self.dirty.add(i)
+    def slots_between(self, m, start, end):
+        """Yield (time, min, sum, max, count) of metric *m* for the slots in [start, end)."""
+        first,last=start//self.step,-(-end//self.step)
+        for i,period in enumerate(self.stamp):
+            if not first<=period<last: continue
+            k=i*self.width+m
+            if self.count[k]: yield period*self.step,self.min[k],self.sum[k],self.max[k],self.count[k]
+    def write_dirty(self, fd, offset):
+        runs=[]
+        for i in sorted(self.dirty):
+            if runs and runs[-1][1]==i: runs[-1][1]=i+1
+            else: runs.append([i,i+1])
+        self.dirty=set()
+        for a,b in runs:
+            pos=offset
+            for arr,per in self.arrays():
+                os.pwrite(fd,arr[a*per:b*per].tobytes(),pos+a*per*arr.itemsize)
+                pos+=len(arr)*arr.itemsize
+
+def _celsius(v):
+    try: return float(str(v).split('°')[0])
+    except ValueError: return None
+
+def _number(v):
+    return v if isinstance(v,(int,float)) and not isinstance(v,bool) else None
+
+def history_values(sample):
+    ssd=sample['ssd_all']
+    ssd_temp=ssd.get(CONFIG.get("ssd_sensor")) or next(iter(ssd.values()),None)
+    return (_number(sample['cpu_usage']),_celsius(sample['cpu_temp']),_number(sample['cpu_freq_current']),
+            _number(sample['mem_percent']),_number(sample['disk_percent']),
+            _celsius(ssd_temp) if ssd_temp else None,_number(sample['throttled']))
+
+class MetricsHistory:
+    def __init__(self, path, metrics=HISTORY_METRICS, tiers=HISTORY_TIERS):
+        self.path=path; self.metrics=metrics
+        self.tiers=[HistoryTier(step,slots,len(metrics)) for step,slots in tiers]
+        self.header=json.dumps({'version':1,'metrics':metrics,'tiers':tiers}).encode().ljust(HISTORY_HEADER)
+        self.lock=threading.Lock()
+        self.last_save=time.time()
+        self.on_disk=self.load()
+    def load(self):
+        try:
+            with open(self.path,'rb') as f:
+                if f.read(HISTORY_HEADER)!=self.header: return False
+                for tier in self.tiers:
+                    for arr,_ in tier.arrays():
+                        n=len(arr); del arr[:]; arr.fromfile(f,n)
+            return True
+        except (OSError,EOFError,ValueError):
+            # Missing, truncated or from another layout: start empty.
+            self.tiers=[HistoryTier(t.step,t.slots,t.width) for t in self.tiers]
+            return False
+    def add(self, t, sample):
+        values=history_values(sample)
+        with self.lock:
+            for tier in self.tiers: tier.add(t,values)
+        if t-self.last_save>=HISTORY_SAVE_INTERVAL:
+            self.save()
+    def save(self):
+        with self.lock:
+            self.last_save=time.time()
+            try:
+                if not self.on_disk:
+                    tmp=self.path+".tmp"
+                    with open(tmp,'wb') as f:
+                        f.write(self.header)
+                        for tier in self.tiers:
+                            for arr,_ in tier.arrays(): arr.tofile(f)
+                            tier.dirty=set()
+                        f.flush(); os.fsync(f.fileno())
+                    os.replace(tmp,self.path)
+                    self.on_disk=True
+                    return
+                fd=os.open(self.path,os.O_WRONLY)
+                try:
+                    offset=HISTORY_HEADER
+                    for tier in self.tiers:
+                        tier.write_dirty(fd,offset)
+                        offset+=tier.nbytes()
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                self.on_disk=False
+                app.logger.warning("Could not save metrics history: %s",e)
+    def query(self, metric, start, end, step=None):
+        """Aggregate *metric* over [start, end) into buckets of *step* seconds (at least
+        the resolution of the tier that still covers *start*); returns (step, points)
+        with points as [time, min, avg, max], or None values for empty buckets."""
+        m=self.metrics.index(metric)
+        # Nothing is kept outside [now - longest tier, now].
+        now=time.time()
+        start=max(start,now-max(t.step*t.slots for t in self.tiers)); end=min(end,now)
+        if end<=start: return step or self.tiers[0].step,[]
+        age=now-start
+        covering=[t for t in self.tiers if t.step*t.slots>=age] or self.tiers[-1:]
+        step=max(step or 0,(end-start)/HISTORY_MAX_POINTS)
+        tier=max((t for t in covering if t.step<=step),key=lambda t:t.step,default=covering[0])
+        step=max(tier.step,int(-(-step//tier.step))*tier.step)
+        start=start//step*step
+        n=max(0,int(-(-(end-start)//step)))
+        agg=[None]*n
+        with self.lock:
+            for t,lo,total,hi,count in tier.slots_between(m,start,end):
+                b=int((t-start)//step)
+                if not 0<=b<n: continue
+                a=agg[b]
+                if a is None: agg[b]=[lo,total,hi,count]
+                else: a[0]=min(a[0],lo); a[1]+=total; a[2]=max(a[2],hi); a[3]+=count
+        points=[]
+        for b,a in enumerate(agg):
+            t=int(start+b*step)
+            if a is None: points.append([t,None,None,None])
+            else: points.append([t,round(a[0],2),round(a[1]/a[3],2),round(a[2],2)])
+        return step,points
+
+_history=None
+_history_lock=threading.Lock()
+
+def get_history():
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                h=MetricsHistory(HISTORY_FILE)
+                atexit.register(h.save)
+                _history=h
+    return _history
+
+# --- Background monitoring sampler ---
+# One thread samples the system on a fixed cadence into a bounded ring buffer;
+# request handlers only ever read the newest entry, so the cost of monitoring
+# does not grow with the number of polling clients.
+class MonitorSampler(threading.Thread):
+    def __init__(self, interval, history):
+        super().__init__(name="monitor-sampler", daemon=True)
+        self.interval=max(0.2,float(interval))
+        self.samples=deque(maxlen=max(1,int(history)))
+        self.stopped=threading.Event()
+    def sample(self):
+        t,data=time.time(),collect_monitoring_data()
+        self.samples.append((t,data))
+        get_history().add(t,data)
+    def run(self):
+        while not self.stopped.is_set():
+            try: self.sample()
+            except Exception as e: app.logger.warning("Monitoring sample failed: %s",e)
+            self.stopped.wait(self.interval)
+    def latest(self):
+        try: return self.samples[-1]
+        except IndexError: return None
+    def stop(self):
+        self.stopped.set()
+
+_sampler=None
+_sampler_lock=threading.Lock()
+
+def get_sampler():
+    # Started lazily so the reloader parent process of the dev server never samples.
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                s=MonitorSampler(CONFIG.get("sample_interval",1.0),CONFIG.get("sample_history",120))
+                s.sample(); s.start()
+                _sampler=s
+    return _sampler
+
+def apply_config(old, new):
+    # Settings that live outside CONFIG follow it, whether changed from the
+    # settings page or by editing config.cfg.
+    app.secret_key=new['secret_key']
+    if _sampler is not None and new['sample_interval']!=old['sample_interval']:
+        _sampler.interval=max(0.2,new['sample_interval'])
+
+CONFIG.on_change(apply_config)
+
+def get_monitoring_data(sensor=None):
+    if sensor is None: sensor=CONFIG.get("ssd_sensor")
+    m=dict(get_sampler().latest()[1])
+    ssd_temps=m['ssd_all']
+    if not ssd_temps:
+        ssd_name,ssd_temp=None,"N/A"
+    else:
+        if sensor and sensor in ssd_temps:
+            ssd_name,ssd_temp=sensor,ssd_temps[sensor]
+        else:
+            ssd_name,ssd_temp=next(iter(ssd_temps.items()))
+    m['ssd_selected_name']=ssd_name; m['ssd_temp']=ssd_temp
+    return m
+
+def monitoring_payload(sensor):
     m=get_monitoring_data(sensor)
-    return jsonify({
+    return {
         'cpu_usage':m['cpu_usage'],'cpu_temp':m['cpu_temp'],
         'cpu_freq_current':m['cpu_freq_current'],'cpu_freq_max':m['cpu_freq_max'],
         'mem_percent':m['mem_percent'],'mem_used_human':format_filesize(m['mem_used']),
@@ -183,7 +1606,320 @@ def api_monitoring():
         'disk_total_human':format_filesize(m['disk_total']),'disk_free_human':format_filesize(m['disk_free']),
         'ssd_temp':m['ssd_temp'],'ssd_selected_name':m['ssd_selected_name'],'ssd_all':m['ssd_all'],
         'uptime':m['uptime']
-    })
+    }
+
+@app.route('/api/monitoring')
+@requires_auth
+def api_monitoring():
+    sensor=request.args.get('ssd_sensor') or CONFIG.get("ssd_sensor")
+    return jsonify(monitoring_payload(sensor))
+
+@app.route('/metrics')
+@requires_auth
+def metrics():
+    return Response(render_metrics(),mimetype='text/plain; version=0.0.4')
+
+SSE_KEEPALIVE = 15
+# Set when the server is stopping, so open monitoring streams end instead of
+# holding a request thread until the process is killed.
+SHUTTING_DOWN = threading.Event()
+
+@app.route('/api/monitoring/history')
+@requires_auth
+def api_monitoring_history():
+    metric=request.args.get('metric','')
+    if metric not in HISTORY_METRICS:
+        return jsonify({'error':'Unknown metric.','metrics':HISTORY_METRICS}),400
+    now=time.time()
+    try:
+        # from/to are Unix times; zero or negative values are relative to now.
+        start=float(request.args.get('from',-3600)); end=float(request.args.get('to',0))
+        step=float(request.args['step']) if request.args.get('step') else None
+    except ValueError:
+        return jsonify({'error':'Invalid from, to or step.'}),400
+    if not all(math.isfinite(v) for v in (start,end,step or 0)) or (step is not None and step<0):
+        return jsonify({'error':'Invalid from, to or step.'}),400
+    if start<=0: start+=now
+    if end<=0: end+=now
+    if end<=start: return jsonify({'error':'to must be after from.'}),400
+    step,points=get_history().query(metric,start,end,step)
+    return jsonify({'metric':metric,'from':start,'to':end,'step':step,'points':points})
+
+@app.route('/api/monitoring/stream')
+@requires_auth
+def api_monitoring_stream():
+    # Server-Sent Events: the first event carries every field, later events only
+    # the fields that changed since the previous one. Auth and routing happen once
+    # per connection instead of once per refresh tick.
+    sensor=request.args.get('ssd_sensor') or CONFIG.get("ssd_sensor")
+    def events():
+        last={}; idle=0.0
+        yield f"retry: {int(CONFIG['monitor_refresh']*1000)}\n\n"
+        while True:
+            cur=monitoring_payload(sensor)
+            diff={k:v for k,v in cur.items() if last.get(k)!=v}
+            last=cur
+            if diff:
+                idle=0.0
+                yield f"data: {json.dumps(diff)}\n\n"
+            elif idle>=SSE_KEEPALIVE:
+                idle=0.0
+                yield ": keep-alive\n\n"
+            refresh=CONFIG['monitor_refresh']
+            if SHUTTING_DOWN.wait(refresh): return
+            idle+=refresh
+    return Response(events(),mimetype='text/event-stream',
+                    headers={'Cache-Control':'no-cache','X-Accel-Buffering':'no'})
+
+# --- Fleet view ---
+# With `peers` set in config.cfg (comma-separated panel URLs, each optionally
+# written name=URL, with user:password@ when that panel's login differs from
+# this one's), /fleet shows every panel's monitoring on one page. A background
+# thread polls each peer's /api/monitoring every `fleet_refresh` seconds from a
+# small pool, over one keep-alive connection per peer with a `peer_timeout`,
+# backing off exponentially while a peer fails. Pages only read the last known
+# values, so a slow or offline Pi never holds them up. Polling pauses when the
+# fleet has not been looked at for FLEET_IDLE seconds.
+FLEET_WORKERS = 16
+FLEET_IDLE = 300
+FLEET_BACKOFF_MAX = 60
+FLEET_TICK = 0.25
+
+class Peer:
+    def __init__(self, spec):
+        name,sep,url=spec.partition('=')
+        if not sep or '/' in name or ':' in name: name,url='',spec
+        if '://' not in url: url='http://'+url
+        u=urllib.parse.urlsplit(url)
+        if u.scheme not in ('http','https') or not u.hostname:
+            raise ValueError(f"Not a panel URL: {spec}")
+        self.key=spec
+        self.https=u.scheme=='https'; self.host=u.hostname; self.port=u.port
+        netloc=u.hostname+(f":{u.port}" if u.port else "")
+        self.name=name.strip() or netloc
+        self.url=f"{u.scheme}://{netloc}{u.path.rstrip('/')}/"
+        self.path=u.path.rstrip('/')+'/api/monitoring'
+        login=urllib.parse.unquote(u.username) if u.username else CONFIG['login']
+        password=urllib.parse.unquote(u.password or '') if u.username else CONFIG['password']
+        self.auth='Basic '+base64.b64encode(f"{login}:{password}".encode()).decode()
+        self.conn=None; self.busy=False
+        self.data=None; self.updated=None; self.latency=None
+        self.error=None; self.failures=0; self.next_poll=0.0
+    def _request(self, timeout):
+        if self.conn is None:
+            cls=http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self.conn=cls(self.host,self.port,timeout=timeout)
+        self.conn.request('GET',self.path,headers={'Authorization':self.auth,'Accept':'application/json'})
+        resp=self.conn.getresponse(); body=resp.read()
+        if resp.status!=200:
+            raise http.client.HTTPException(f"HTTP {resp.status}")
+        return json.loads(body)
+    def poll(self, interval, timeout):
+        t0=time.monotonic()
+        try:
+            try:
+                data=self._request(timeout)
+            except (http.client.RemoteDisconnected,ConnectionResetError,BrokenPipeError):
+                # The peer closed an idle keep-alive connection; retry once on a new one.
+                self.close(); data=self._request(timeout)
+        except (OSError,http.client.HTTPException,ValueError) as e:
+            self.close()
+            self.failures+=1; self.error=str(e) or e.__class__.__name__
+            self.next_poll=time.monotonic()+min(FLEET_BACKOFF_MAX,interval*2**self.failures)
+        else:
+            self.data=data; self.updated=time.time(); self.latency=time.monotonic()-t0
+            self.failures=0; self.error=None
+            self.next_poll=t0+interval
+        finally:
+            self.busy=False
+    def close(self):
+        if self.conn is not None:
+            self.conn.close(); self.conn=None
+    def to_dict(self):
+        if self.data is None: status='offline' if self.failures else 'pending'
+        else: status='online' if self.error is None else 'stale'
+        return {'name':self.name,'url':self.url,'status':status,'data':self.data,
+                'updated':self.updated,'age':round(time.time()-self.updated,1) if self.updated else None,
+                'latency_ms':round(self.latency*1000,1) if self.latency is not None else None,
+                'error':self.error,'failures':self.failures}
+
+class FleetMonitor(threading.Thread):
+    def __init__(self):
+        super().__init__(name="fleet", daemon=True)
+        self.pool=ThreadPoolExecutor(max_workers=FLEET_WORKERS,thread_name_prefix="fleet-poll")
+        self.spec=None; self.peers=[]; self.invalid=[]
+        self.last_viewed=time.monotonic()
+    def configure(self):
+        spec=CONFIG.get('peers','')
+        if spec==self.spec: return
+        # Peers that are still configured keep their connection and last values.
+        known={p.key:p for p in self.peers}; peers=[]; invalid=[]
+        for item in (s.strip() for s in spec.split(',')):
+            if not item: continue
+            try: peers.append(known.get(item) or Peer(item))
+            except ValueError as e: invalid.append(str(e))
+        self.peers,self.invalid,self.spec=peers,invalid,spec
+    def status(self):
+        self.last_viewed=time.monotonic()
+        self.configure()
+        return [p.to_dict() for p in self.peers]
+    def run(self):
+        while True:
+            try:
+                self.configure()
+                now=time.monotonic()
+                if now-self.last_viewed<FLEET_IDLE:
+                    interval=max(0.5,CONFIG['fleet_refresh']); timeout=CONFIG['peer_timeout']
+                    for p in self.peers:
+                        if not p.busy and now>=p.next_poll:
+                            p.busy=True
+                            self.pool.submit(p.poll,interval,timeout)
+            except Exception as e:
+                app.logger.warning("Fleet polling failed: %s",e)
+            time.sleep(FLEET_TICK)
+
+_fleet=None
+_fleet_lock=threading.Lock()
+
+def get_fleet():
+    global _fleet
+    if _fleet is None:
+        with _fleet_lock:
+            if _fleet is None:
+                f=FleetMonitor(); f.start()
+                _fleet=f
+    return _fleet
+
+def fleet_status():
+    peers=get_fleet().status()
+    local={'name':socket.gethostname()+' (this panel)','url':url_for('dir_listing',req_path=''),'status':'online',
+           'data':monitoring_payload(CONFIG.get("ssd_sensor")),'updated':time.time(),'age':0.0,
+           'latency_ms':None,'error':None,'failures':0}
+    return [local]+peers
+
+@app.route('/api/fleet')
+@requires_auth
+def api_fleet():
+    return jsonify({'refresh':CONFIG['fleet_refresh'],'panels':fleet_status(),'invalid':get_fleet().invalid})
+
+@app.route('/fleet')
+@requires_auth
+def fleet():
+    return render_template('fleet.html', panels=fleet_status(), invalid=get_fleet().invalid, refresh=CONFIG['fleet_refresh'])
+
+LIST_PAGE_SIZE = 200
+LIST_PAGE_MAX = 1000
+
+def listing_row(f):
+    size=entry_size(f)
+    return {
+        'name':f['name'],'path':f['path'],'is_dir':f['is_dir'],'file_type':f['file_type'],
+        'mtime':f['mtime'],'mtime_human':format_datetime(f['mtime']),
+        'size':size,'size_human':format_filesize(size),'size_pending':f['is_dir'] and size is None
+    }
+
+@app.route('/api/list/', defaults={'req_path':''})
+@app.route('/api/list/<path:req_path>')
+@requires_auth
+def api_list(req_path):
+    path=safe_path(req_path)
+    try: st=os.stat(path)
+    except OSError: st=None
+    if not st or not stat.S_ISDIR(st.st_mode):
+        return jsonify({'error':'Not a folder.'}),404
+    etag=listing_etag(path,st)
+    if request.if_none_match.contains_weak(etag):
+        return tag_listing(Response(status=304),etag)
+    try:
+        offset=max(0,int(request.args.get('offset',0)))
+        limit=min(LIST_PAGE_MAX,max(1,int(request.args.get('limit',LIST_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({'error':'Invalid offset or limit.'}),400
+    try:
+        version,files=sorted_view(path,request.args.get('sort','name'),request.args.get('order','asc'),request.args.get('view',type=int))
+    except PermissionError:
+        return jsonify({'error':'Permission denied.'}),403
+    request_folder_sizes(files)
+    page=files[offset:offset+limit]
+    end=offset+len(page)
+    return tag_listing(jsonify({
+        'path':rel_path(path),'total':len(files),'offset':offset,'view':version,
+        'next_offset':end if end<len(files) else None,
+        'entries':[listing_row(f) for f in page]
+    }),etag)
+
+@app.route('/api/folder_sizes/', defaults={'req_path':''})
+@app.route('/api/folder_sizes/<path:req_path>')
+@requires_auth
+def api_folder_sizes(req_path):
+    path=safe_path(req_path)
+    if not os.path.isdir(path):
+        return jsonify({'error':'Not a folder.'}),404
+    try: files=get_listing(path)
+    except PermissionError: return jsonify({'error':'Permission denied.'}),403
+    request_folder_sizes(files)
+    sizes={}
+    for f in files:
+        if f['is_dir']:
+            size=entry_size(f)
+            sizes[f['path']]=None if size is None else format_filesize(size)
+    return jsonify(sizes)
+
+@app.route('/api/library/stats')
+@requires_auth
+def api_library_stats():
+    st=get_library().stats()
+    for key in ('systems','largest_folders','extensions'):
+        for x in st[key]: x['bytes_human']=format_filesize(x['bytes'])
+    st['bytes_human']=format_filesize(st['bytes'])
+    return jsonify(st)
+
+def search_args():
+    q=request.args.get('q','').strip()
+    prefix=request.args.get('mode')=='prefix'
+    try: page=max(1,int(request.args.get('page',1)))
+    except ValueError: page=1
+    return q,prefix,request.args.get('system') or None,page
+
+@app.route('/api/search')
+@requires_auth
+def api_search():
+    q,prefix,system,page=search_args()
+    if not q: return jsonify({'error':'Empty query.'}),400
+    t0=time.time()
+    total,rows=get_library().search(q,prefix,system,(page-1)*SEARCH_PAGE_SIZE)
+    for r in rows: r['size_human']=format_filesize(r['size']); r['mtime_human']=format_datetime(r['mtime'])
+    return jsonify({'q':q,'page':page,'page_size':SEARCH_PAGE_SIZE,'total':total,
+                    'elapsed_ms':round((time.time()-t0)*1000,1),'results':rows})
+
+@app.route('/search')
+@requires_auth
+def search():
+    q,prefix,system,page=search_args()
+    total,rows,elapsed=0,[],0
+    if q:
+        t0=time.time()
+        total,rows=get_library().search(q,prefix,system,(page-1)*SEARCH_PAGE_SIZE)
+        elapsed=round((time.time()-t0)*1000,1)
+    pages=max(1,(total+SEARCH_PAGE_SIZE-1)//SEARCH_PAGE_SIZE)
+    return render_template('search.html', q=q, prefix=prefix, system=system, page=page, pages=pages, total=total, rows=rows, elapsed=elapsed, library=get_library())
+
+def duplicate_args():
+    try: min_size=max(1,int(request.args.get('min_size',1)))
+    except ValueError: min_size=1
+    return rel_path(safe_path(request.args.get('path',''))),min_size
+
+@app.route('/api/duplicates')
+@requires_auth
+def api_duplicates():
+    root,min_size=duplicate_args()
+    return jsonify(duplicate_report(root,min_size))
+
+@app.route('/duplicates')
+@requires_auth
+def duplicates():
+    root,min_size=duplicate_args()
+    return render_template('duplicates.html', report=duplicate_report(root,min_size), root=root, library=get_library())
 
 @app.route('/control', methods=['POST'])
 @requires_auth
@@ -202,26 +1938,43 @@ def control():
 @app.route('/settings', methods=['GET','POST'])
 @requires_auth
 def settings():
-    global CONFIG,USERNAME,PASSWORD,app
     msg=""
     if request.method=='POST':
+        changes={}
         if 'save_credentials' in request.form:
             nl, np = request.form.get('login','').strip(), request.form.get('password','').strip()
-            if nl: CONFIG['login']=nl; USERNAME=nl
-            if np: CONFIG['password']=np; PASSWORD=np
+            if nl: changes['login']=nl
+            if np: changes['password']=np
             msg+="Credentials updated. "
         elif 'save_app_settings' in request.form:
             sk = request.form.get('secret_key','').strip()
             p = request.form.get('port','').strip()
             r = request.form.get('monitor_refresh','').strip()
-            CONFIG['show_nvme'] = (request.form.get('show_nvme')=='on')
-            cl = request.form.get('config_location','64').strip()
-            CONFIG['config_location']=cl
-            if sk: CONFIG['secret_key']=sk; app.secret_key=sk
-            if p.isdigit(): CONFIG['port']=int(p)
+            si = request.form.get('sample_interval','').strip()
+            changes['show_nvme'] = (request.form.get('show_nvme')=='on')
+            changes['sensor_fallback'] = (request.form.get('sensor_fallback')=='on')
+            changes['config_location'] = request.form.get('config_location','64').strip()
+            changes['peers'] = ', '.join(s.strip() for s in request.form.get('peers','').replace('\n',',').split(',') if s.strip())
+            if sk: changes['secret_key']=sk
+            if p.isdigit(): changes['port']=int(p)
             try:
                 rv=float(r)
-                if rv>=0.5: CONFIG['monitor_refresh']=rv
+                if rv>=0.5: changes['monitor_refresh']=rv
+            except:
+                pass
+            try:
+                sv=float(si)
+                if sv>=0.2: changes['sample_interval']=sv
+            except:
+                pass
+            try:
+                fr=float(request.form.get('fleet_refresh',''))
+                if fr>=0.5: changes['fleet_refresh']=fr
+            except:
+                pass
+            try:
+                pt=float(request.form.get('peer_timeout',''))
+                if pt>0: changes['peer_timeout']=pt
             except:
                 pass
             msg+="App settings updated. (Port change on restart.) "
@@ -233,68 +1986,10 @@ def settings():
             subprocess.call(["systemctl","disable","web_panel.service"]); msg+="Service disabled. "
         elif 'stop_service' in request.form:
             subprocess.call(["systemctl","stop","web_panel.service"]); msg+="Service stopped. "
-        save_config(CONFIG)
+        CONFIG.update(**changes)
         flash(msg)
         return redirect(url_for('settings'))
-    return render_template_string("""
-<!doctype html>
-<html lang="en"><head>
-  <meta charset="utf-8">
-  <title>Settings</title>
-  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css" rel="stylesheet">
-  <style>.nav-tabs .nav-link{cursor:pointer;}</style>
-</head><body>
-  <div class="container py-4">
-    <h1>Settings</h1>
-    {% with messages=get_flashed_messages() %}
-      {% if messages %}
-        {% for m in messages %}
-          <div class="alert alert-info">{{m}}</div>
-        {% endfor %}
-      {% endif %}
-    {% endwith %}
-    <ul class="nav nav-tabs" id="tab" role="tablist">
-      <li class="nav-item"><button class="nav-link active" data-bs-toggle="tab" data-bs-target="#creds">Credentials</button></li>
-      <li class="nav-item"><button class="nav-link" data-bs-toggle="tab" data-bs-target="#app">App Settings</button></li>
-      <li class="nav-item"><button class="nav-link" data-bs-toggle="tab" data-bs-target="#svc">Service</button></li>
-    </ul>
-    <div class="tab-content pt-3">
-      <div class="tab-pane fade show active" id="creds">
-        <form method="post">
-          <div class="mb-3"><label class="form-label">Login</label><input class="form-control" name="login" value="{{config['login']}}"></div>
-          <div class="mb-3"><label class="form-label">Password</label><input class="form-control" name="password" value="{{config['password']}}"></div>
-          <button class="btn btn-primary" name="save_credentials">Save Credentials</button>
-        </form>
-      </div>
-      <div class="tab-pane fade" id="app">
-        <form method="post">
-          <div class="mb-3"><label class="form-label">Secret Key</label><input class="form-control" name="secret_key" value="{{config['secret_key']}}"></div>
-          <div class="mb-3"><label class="form-label">Port</label><input type="number" class="form-control" name="port" value="{{config['port']}}"></div>
-          <div class="mb-3"><label class="form-label">Refresh Interval (sec, ≥0.5)</label><input type="number" step="0.1" class="form-control" name="monitor_refresh" value="{{config['monitor_refresh']}}"></div>
-          <div class="form-check mb-3"><input class="form-check-input" type="checkbox" name="show_nvme" {% if config['show_nvme'] %}checked{% endif %}><label class="form-check-label">Display NVMe Temp</label></div>
-          <div class="mb-3"><label class="form-label">Config File Location</label>
-            <select class="form-select" name="config_location">
-              <option value="64" {% if config['config_location']=='64' %}selected{% endif %}>64-bit (/boot/firmware/config.txt)</option>
-              <option value="32" {% if config['config_location']=='32' %}selected{% endif %}>32-bit (/boot/config.txt)</option>
-            </select>
-          </div>
-          <button class="btn btn-primary" name="save_app_settings">Save App Settings</button>
-        </form>
-      </div>
-      <div class="tab-pane fade" id="svc">
-        <form method="post">
-          <button class="btn btn-warning mb-2" name="restart_service">Restart Service</button>
-          <button class="btn btn-danger mb-2" name="stop_service">Stop Service</button>
-          <button class="btn btn-success mb-2" name="enable_service">Enable Service</button>
-          <button class="btn btn-danger mb-2" name="disable_service">Disable Service</button>
-        </form>
-      </div>
-    </div>
-    <a href="{{url_for('dir_listing',req_path='')}}" class="btn btn-secondary mt-3">Back to File Manager</a>
-  </div>
-  <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/js/bootstrap.bundle.min.js"></script>
-</body></html>
-""", config=CONFIG)
+    return render_template('settings.html', config=CONFIG)
 
 @app.route('/edit/<path:req_path>', methods=['GET','POST'])
 @requires_auth
@@ -306,6 +2001,7 @@ def edit_file(req_path):
         c=request.form.get('content','')
         try:
             with open(abs_path,'w',encoding='utf-8') as f: f.write(c)
+            mark_changed(os.path.dirname(abs_path))
             flash("File updated."); return redirect(url_for('dir_listing',req_path=posixpath.dirname(req_path)))
         except Exception as e:
             flash(f"Error saving: {e}")
@@ -314,23 +2010,7 @@ def edit_file(req_path):
             with open(abs_path,'r',encoding='utf-8') as f: content=f.read()
         except Exception as e:
             flash(f"Error reading: {e}"); return redirect(url_for('dir_listing',req_path=posixpath.dirname(req_path)))
-        return render_template_string("""
-<!doctype html>
-<html lang="en"><head>
-  <meta charset="utf-8"><title>Edit File</title>
-  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css" rel="stylesheet">
-</head><body>
-  <div class="container py-4">
-    <h1>Edit file: {{filename}}</h1>
-    <form method="post">
-      <div class="mb-3"><textarea name="content" rows="20" class="form-control">{{content}}</textarea></div>
-      <button class="btn btn-primary">Save Changes</button>
-      <a href="{{url_for('dir_listing',req_path=parent)}}" class="btn btn-secondary">Cancel</a>
-    </form>
-  </div>
-<script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/js/bootstrap.bundle.min.js"></script>
-</body></html>
-""", filename=os.path.basename(abs_path),content=content,parent=posixpath.dirname(req_path))
+        return render_template('edit_file.html', filename=os.path.basename(abs_path),content=content,parent=posixpath.dirname(req_path))
 
 @app.route('/edit_config', methods=['GET','POST'])
 @requires_auth
@@ -347,35 +2027,16 @@ def edit_config():
         with open(config_path,'r',encoding='utf-8') as f: content=f.read()
     except Exception as e:
         flash(f"Error reading: {e}"); return redirect(url_for('dir_listing',req_path=''))
-    return render_template_string("""
-<!doctype html>
-<html lang="en"><head>
-  <meta charset="utf-8"><title>Edit RPI config.txt</title>
-  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css" rel="stylesheet">
-</head><body>
-  <div class="container py-4">
-    <h1>Edit RPI config.txt at {{path}}</h1>
-    <form method="post">
-      <div class="mb-3"><textarea name="content" rows="20" class="form-control">{{content}}</textarea></div>
-      <button class="btn btn-primary">Save Changes</button>
-      <a href="{{url_for('dir_listing',req_path='')}}" class="btn btn-secondary">Cancel</a>
-    </form>
-  </div>
-<script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/js/bootstrap.bundle.min.js"></script>
-</body></html>
-""",content=content,path=config_path)
+    return render_template('edit_config.html', content=content,path=config_path)
 
 @app.route('/delete_bulk', methods=['POST'])
 @requires_auth
 def delete_bulk():
     sel=request.form.getlist('selected_files')
-    for f in sel:
-        p=safe_path(f)
-        try:
-            if os.path.isdir(p): shutil.rmtree(p)
-            elif os.path.isfile(p): os.remove(p)
-        except Exception as e: flash(f"Error deleting {f}: {e}")
-    flash("Selected items deleted.")
+    job,err=submit_job('delete',sel)
+    flash_job(job,err,"Selected items deleted.","Deleting selected items")
+    nxt=request.form.get('next','')
+    if nxt.startswith('/') and not nxt.startswith(('//','/\\')): return redirect(nxt)
     return redirect(url_for('dir_listing',req_path=posixpath.dirname(sel[0]) if sel else ''))
 
 @app.route('/create_folder/<path:req_path>', methods=['POST'])
@@ -387,30 +2048,237 @@ def create_folder(req_path):
     new=os.path.join(d,secure_filename(name))
     try: os.makedirs(new); flash("Folder created.")
     except Exception as e: flash(f"Error creating folder: {e}")
+    mark_changed(d)
     return redirect(url_for('dir_listing',req_path=req_path))
 
 @app.route('/upload/<path:req_path>', methods=['POST'])
 @requires_auth
 def upload_file(req_path):
     d=safe_path(req_path)
-    if 'file' not in request.files:
-        flash("No file selected."); return redirect(url_for('dir_listing',req_path=req_path))
-    for f in request.files.getlist('file'):
-        if f.filename=='':
-            flash("One file missing name."); continue
-        fn=secure_filename(f.filename)
-        dest=os.path.join(d,fn)
+    # The form is parsed straight into temporary files in d, so it has to exist first.
+    if not os.path.isdir(d) or not os.access(d,os.W_OK):
+        flash("Error saving upload: the folder does not exist or is not writable.")
+        return redirect(url_for('dir_listing',req_path=req_path))
+    request.stream_uploads_to(d)
+    with active_transfer():
         try:
-            with open(dest,'wb') as o:
-                while True:
-                    chunk = f.stream.read(8192)
-                    if not chunk: break
-                    o.write(chunk)
-            flash(f"File '{fn}' uploaded successfully.")
-        except Exception as e:
-            flash(f"Error saving '{fn}': {e}")
+            try: files=request.files.getlist('file')
+            except OSError as e:
+                # e.g. the disk filled up while the form was being parsed.
+                flash(f"Error saving upload: {e}"); return redirect(url_for('dir_listing',req_path=req_path))
+            if not files:
+                flash("No file selected."); return redirect(url_for('dir_listing',req_path=req_path))
+            for f in files:
+                if f.filename=='':
+                    flash("One file missing name."); continue
+                fn=secure_filename(f.filename)
+                dest=os.path.join(d,fn)
+                try:
+                    commit_upload(f,dest)
+                    flash(f"File '{fn}' uploaded successfully.")
+                except Exception as e:
+                    flash(f"Error saving '{fn}': {e}")
+        finally:
+            # Parts that were not renamed into place (skipped, failed, or left by an aborted request).
+            request.discard_upload_parts()
+            mark_changed(d)
     return redirect(url_for('dir_listing',req_path=req_path))
 
+# --- Resumable chunked uploads ---
+# Protocol: POST /api/uploads creates (or resumes) an upload and returns its id,
+# the chunk size and the byte ranges already received; PUT /api/uploads/<id>
+# with ?offset= writes one chunk at that offset (chunks may arrive in parallel
+# and in any order); GET /api/uploads/<id> reports the received ranges; POST
+# /api/uploads/<id>/finalize checks completeness and an optional checksum and
+# renames the data into place. Data is written to a .part file in the target
+# folder; the small state record lives in a private directory next to
+# config.cfg so uploads survive restarts. The service runs as root, so the
+# record is not trusted either: its folder is stored relative to BASE_DIR and
+# re-checked with safe_path() when it is loaded.
+UPLOAD_STATE_DIR = os.path.join(os.path.dirname(CONFIG_FILE), "upload_state")
+UPLOAD_CHUNK_SIZE = 8*1024*1024
+UPLOAD_EXPIRY = 7*24*3600
+
+class ChunkedUpload:
+    def __init__(self, id, dir, name, size, chunk_size=UPLOAD_CHUNK_SIZE, received=None, updated=None, fingerprint=''):
+        self.id=id; self.dir=dir; self.name=name; self.size=size; self.chunk_size=chunk_size
+        self.fingerprint=fingerprint
+        self.received=received or []
+        self.updated=updated or time.time()
+        self.lock=threading.Lock()
+    @property
+    def part_path(self): return os.path.join(self.dir,f"{UPLOAD_PART_PREFIX}{self.id}.part")
+    @property
+    def state_path(self): return os.path.join(UPLOAD_STATE_DIR,self.id+".json")
+    def add_range(self, start, end):
+        # Keep received as sorted, merged [start, end) pairs.
+        ranges=sorted(self.received+[[start,end]])
+        merged=[]
+        for a,b in ranges:
+            if merged and a<=merged[-1][1]: merged[-1][1]=max(merged[-1][1],b)
+            else: merged.append([a,b])
+        self.received=merged
+    def received_bytes(self): return sum(b-a for a,b in self.received)
+    def complete(self): return self.size==0 or self.received==[[0,self.size]]
+    def to_dict(self):
+        return {'id':self.id,'dir':rel_path(self.dir),'name':self.name,'size':self.size,'chunk_size':self.chunk_size,
+                'received':self.received,'updated':self.updated,'fingerprint':self.fingerprint}
+    @classmethod
+    def load(cls, fn):
+        with open(os.path.join(UPLOAD_STATE_DIR,fn)) as f: state=json.load(f)
+        if not isinstance(state,dict): raise ValueError("not an upload record")
+        d,name,upload_id=state.get('dir'),state.get('name'),state.get('id')
+        if not (isinstance(d,str) and isinstance(name,str) and isinstance(upload_id,str) and type(state.get('size'))==int) \
+                or fn!=upload_id+".json" or not upload_id.isalnum() or not name or secure_filename(name)!=name:
+            raise ValueError("invalid upload record")
+        try: state['dir']=safe_path(d)
+        except HTTPException: raise ValueError("upload outside BASE_DIR")
+        return cls(**state)
+    def save(self):
+        self.updated=time.time()
+        tmp=self.state_path+".tmp"
+        with open(tmp,"w") as f: json.dump(self.to_dict(),f)
+        os.replace(tmp,self.state_path)
+    def remove(self):
+        for p in (self.part_path,self.state_path):
+            try: os.remove(p)
+            except FileNotFoundError: pass
+    def status(self):
+        return {'id':self.id,'path':rel_path(self.dir),'name':self.name,'size':self.size,'chunk_size':self.chunk_size,
+                'received':self.received,'received_bytes':self.received_bytes(),'complete':self.complete()}
+
+_uploads=None
+_uploads_lock=threading.RLock()
+
+def get_uploads():
+    global _uploads
+    with _uploads_lock:
+        if _uploads is None:
+            _uploads={}
+            try: private_dir(UPLOAD_STATE_DIR)
+            except OSError as e:
+                app.logger.warning("Resumable uploads are disabled: %s",e); return _uploads
+            for fn in os.listdir(UPLOAD_STATE_DIR):
+                if not fn.endswith(".json"): continue
+                try: u=ChunkedUpload.load(fn)
+                except (OSError,ValueError,TypeError): continue
+                if time.time()-u.updated>UPLOAD_EXPIRY or not os.path.exists(u.part_path): u.remove()
+                else: _uploads[u.id]=u
+        return _uploads
+
+def get_upload(upload_id):
+    u=get_uploads().get(upload_id)
+    if u is None: abort(404)
+    return u
+
+@app.route('/api/uploads', methods=['POST'])
+@requires_auth
+def api_upload_init():
+    data=request.get_json(silent=True) or request.form
+    if not isinstance(data,dict) or not all(isinstance(data.get(k,''),str) for k in ('path','name','fingerprint')):
+        return jsonify({'error':'Invalid path, name, size or fingerprint.'}),400
+    d=safe_path(data.get('path',''))
+    name=secure_filename(data.get('name',''))
+    try: size=int(data.get('size',-1))
+    except (TypeError,ValueError): size=-1
+    # Identifies the file's content (the page sends its modification time and a
+    # hash of its first and last bytes), so a different file with the same name
+    # and size never continues an upload of another.
+    fingerprint=data.get('fingerprint','')
+    if not os.path.isdir(d) or not name or size<0 or len(fingerprint)>200:
+        return jsonify({'error':'Invalid path, name, size or fingerprint.'}),400
+    uploads=get_uploads()
+    with _uploads_lock:
+        # Selecting the same file for the same folder again resumes the earlier upload;
+        # an unfinished upload of other content to the same name is dropped.
+        for u in list(uploads.values()):
+            if u.dir==d and u.name==name:
+                if u.size==size and u.fingerprint==fingerprint:
+                    return jsonify(u.status())
+                with u.lock: u.remove()
+                del uploads[u.id]
+        u=ChunkedUpload(uuid.uuid4().hex,d,name,size,fingerprint=fingerprint)
+        try:
+            with open(u.part_path,"wb") as f: f.truncate(size)
+            u.save()
+        except OSError as e:
+            u.remove(); return jsonify({'error':f"Cannot create upload: {e}"}),500
+        uploads[u.id]=u
+    return jsonify(u.status()),201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@requires_auth
+def api_upload_status(upload_id):
+    return jsonify(get_upload(upload_id).status())
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@requires_auth
+def api_upload_chunk(upload_id):
+    u=get_upload(upload_id)
+    try: offset=int(request.args.get('offset',''))
+    except ValueError: return jsonify({'error':'Missing offset.'}),400
+    length=request.content_length
+    if length is None or offset<0 or offset+length>u.size:
+        return jsonify({'error':'Chunk outside the file.'}),416
+    written=0; write_time=0.0
+    fd=os.open(u.part_path,os.O_WRONLY)
+    try:
+        with active_transfer():
+            while written<length:
+                buf=request.stream.read(min(UPLOAD_BUFFER,length-written))
+                if not buf: break
+                t0=time.perf_counter()
+                os.pwrite(fd,buf,offset+written); written+=len(buf)
+                write_time+=time.perf_counter()-t0
+    finally:
+        os.close(fd)
+        UPLOAD_WRITE_SECONDS.observe(write_time)
+        # Even a chunk cut short by a dropped connection counts for what arrived.
+        if written:
+            with u.lock:
+                u.add_range(offset,offset+written); u.save()
+    if written<length:
+        return jsonify({'error':'Incomplete chunk.','received':u.received}),400
+    return jsonify({'received_bytes':u.received_bytes(),'complete':u.complete()})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@requires_auth
+def api_upload_finalize(upload_id):
+    u=get_upload(upload_id)
+    if not u.complete():
+        return jsonify({'error':'Upload is incomplete.','received':u.received}),409
+    data=request.get_json(silent=True) or request.form
+    if not isinstance(data,dict) or not isinstance(data.get('checksum',''),str):
+        return jsonify({'error':'Checksum must look like sha256:<hex>.'}),400
+    checksum=data.get('checksum','')
+    if checksum:
+        algo,_,expected=checksum.partition(':')
+        if algo not in ('md5','sha1','sha256') or not expected:
+            return jsonify({'error':'Checksum must look like sha256:<hex>.'}),400
+        h=hashlib.new(algo)
+        with open(u.part_path,'rb') as f:
+            for buf in iter(lambda:f.read(UPLOAD_BUFFER),b''): h.update(buf)
+        if h.hexdigest()!=expected.lower():
+            # The data is corrupt somewhere; make the client send everything again.
+            with u.lock: u.received=[]; u.save()
+            return jsonify({'error':'Checksum mismatch.','received':[]}),409
+    dest=os.path.join(u.dir,u.name)
+    with open(u.part_path,'rb+') as f: os.fsync(f.fileno())
+    os.chmod(u.part_path,0o666&~_UMASK)
+    os.replace(u.part_path,dest)
+    u.remove()
+    with _uploads_lock: get_uploads().pop(u.id,None)
+    mark_changed(u.dir)
+    return jsonify({'path':rel_path(dest),'size':u.size})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@requires_auth
+def api_upload_cancel(upload_id):
+    u=get_upload(upload_id)
+    u.remove()
+    with _uploads_lock: get_uploads().pop(u.id,None)
+    return jsonify({'cancelled':u.id})
+
 @app.route('/delete/<path:req_path>')
 @requires_auth
 def delete_file(req_path):
@@ -420,6 +2288,7 @@ def delete_file(req_path):
     else:
         try: os.remove(p); flash("File deleted.")
         except Exception as e: flash(f"Error deleting file: {e}")
+        mark_changed(os.path.dirname(p))
     return redirect(url_for('dir_listing',req_path=posixpath.dirname(req_path)))
 
 @app.route('/delete_folder/<path:req_path>')
@@ -429,339 +2298,762 @@ def delete_folder(req_path):
     if not os.path.isdir(p):
         flash("Not a folder.")
     else:
-        try: shutil.rmtree(p); flash("Folder deleted.")
-        except Exception as e: flash(f"Error deleting folder: {e}")
+        job,err=submit_job('delete',[req_path])
+        flash_job(job,err,"Folder deleted.","Deleting folder")
     return redirect(url_for('dir_listing',req_path=posixpath.dirname(req_path)))
 
+@app.route('/rename/<path:req_path>', methods=['POST'])
+@requires_auth
+def rename_entry(req_path):
+    src=safe_path(req_path); parent=os.path.dirname(src)
+    name=request.form.get('new_name','').strip()
+    if not name or name in ('.','..') or '/' in name or '\0' in name:
+        flash("Invalid name.")
+    elif src==BASE_DIR or not os.path.lexists(src):
+        flash("Not found.")
+    else:
+        dst=os.path.join(parent,name)
+        # A case-only rename on a case-insensitive disk "exists" already.
+        if os.path.lexists(dst) and not (os.path.exists(dst) and os.path.samefile(src,dst)):
+            flash(f"{name} already exists.")
+        else:
+            try: os.rename(src,dst)
+            except OSError as e: flash(f"Error renaming: {e}")
+            else:
+                flash("Renamed."); mark_changed(parent,removed=src)
+    return redirect(url_for('dir_listing',req_path=posixpath.dirname(req_path)))
+
+# --- Background jobs ---
+# Deleting, copying and moving whole folders can take minutes on a USB disk, so
+# these run on a small pool of worker threads and the request returns at once.
+# A job first measures its sources (items and bytes) so progress can be shown
+# as a fraction, checks for cancellation between files and after every copied
+# block, and calls mark_changed() for each folder it touched when it ends. An
+# error on one source is recorded and the job carries on with the next one.
+# A move within one filesystem is a single rename(); only moves to another
+# disk copy the data and then delete the source.
+# The last JOB_HISTORY finished jobs stay listed in /api/jobs. Form handlers
+# wait up to JOB_WAIT seconds so quick jobs still report their result directly.
+JOB_WORKERS = 2
+JOB_HISTORY = 50
+JOB_WAIT = 2
+JOB_COPY_BUFFER = 1024*1024
+JOB_COPY_CHUNK = 16*1024*1024
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, kind, sources, dest=None):
+        self.id=uuid.uuid4().hex
+        self.kind=kind; self.sources=sources; self.dest=dest
+        self.state='queued'; self.errors=[]; self.current=None
+        self.items_total=self.items_done=0
+        self.bytes_total=self.bytes_done=0
+        self.created=time.time(); self.started=self.finished=None
+        self.cancelled=threading.Event()
+        self.done=threading.Event()
+        self.touched=set()
+    def check(self):
+        if self.cancelled.is_set(): raise JobCancelled()
+    def to_dict(self):
+        return {
+            'id':self.id,'kind':self.kind,'state':self.state,
+            'sources':[rel_path(p) for p in self.sources],'dest':rel_path(self.dest) if self.dest else None,
+            'items_done':self.items_done,'items_total':self.items_total,
+            'bytes_done':self.bytes_done,'bytes_total':self.bytes_total,
+            'current':rel_path(self.current) if self.current else None,'errors':self.errors,
+            'created':self.created,'started':self.started,'finished':self.finished
+        }
+
+def _same_device(src, dest):
+    return os.lstat(src).st_dev==os.stat(dest).st_dev
+
+def _file_bytes(path):
+    st=os.lstat(path)
+    return st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+def _measure(job, path):
+    def add(p):
+        job.bytes_total+=_file_bytes(p); job.items_total+=1
+    add(path)
+    if not os.path.isdir(path) or os.path.islink(path): return
+    for root,dirs,files in os.walk(path):
+        job.check()
+        job.items_total+=len(dirs)
+        for fn in files:
+            try: add(os.path.join(root,fn))
+            except OSError: pass
+
+def _delete_tree(job, path, count=True):
+    def done(size=0):
+        if count: job.items_done+=1; job.bytes_done+=size
+    if not os.path.isdir(path) or os.path.islink(path):
+        job.check(); job.current=path
+        size=_file_bytes(path); os.remove(path); done(size)
+        return
+    for root,dirs,files in os.walk(path,topdown=False):
+        for name in files:
+            job.check(); p=job.current=os.path.join(root,name)
+            size=_file_bytes(p); os.remove(p); done(size)
+        for name in dirs:
+            job.check(); p=os.path.join(root,name)
+            if os.path.islink(p): os.remove(p)
+            else: os.rmdir(p)
+            done()
+    os.rmdir(path); done()
+
+# File data is copied inside the kernel: copy_file_range() (which can clone
+# blocks on filesystems that support it) and, where that is refused, e.g.
+# across filesystems on older kernels, sendfile(). Both advance the file
+# offsets themselves, so the loop only tracks progress and cancellation; the
+# buffered read/write loop is the last resort.
+KERNEL_COPY = []
+if hasattr(os,'copy_file_range'): KERNEL_COPY.append(lambda fin,fout,n:os.copy_file_range(fin,fout,n))
+if hasattr(os,'sendfile'): KERNEL_COPY.append(lambda fin,fout,n:os.sendfile(fout,fin,None,n))
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV,errno.ENOSYS,errno.EINVAL,errno.EOPNOTSUPP,errno.EBADF}
+
+def _copy_data(job, fi, fo):
+    fin,fout=fi.fileno(),fo.fileno()
+    for copy in KERNEL_COPY:
+        try: n=copy(fin,fout,JOB_COPY_CHUNK)
+        except OSError as e:
+            if e.errno in KERNEL_COPY_UNSUPPORTED: continue
+            raise
+        while n:
+            job.bytes_done+=n; job.check()
+            n=copy(fin,fout,JOB_COPY_CHUNK)
+        return
+    while True:
+        buf=fi.read(JOB_COPY_BUFFER)
+        if not buf: return
+        fo.write(buf); job.bytes_done+=len(buf)
+        job.check()
+
+def _copy_file(job, src, dst):
+    job.check(); job.current=src
+    with open(src,'rb') as fi:
+        fo=open(dst,'xb')
+        try:
+            with fo: _copy_data(job,fi,fo)
+        except BaseException:
+            try: os.remove(dst)
+            except OSError: pass
+            raise
+    shutil.copystat(src,dst)
+    job.items_done+=1
+
+def _copy_tree(job, src, dst):
+    if os.path.islink(src):
+        job.check(); os.symlink(os.readlink(src),dst); job.items_done+=1
+    elif os.path.isdir(src):
+        job.check(); os.mkdir(dst); job.items_done+=1
+        with os.scandir(src) as it: names=[e.name for e in it]
+        for name in names:
+            _copy_tree(job,os.path.join(src,name),os.path.join(dst,name))
+        shutil.copystat(src,dst)
+    else:
+        _copy_file(job,src,dst)
+
+def _job_target(job, src):
+    dst=os.path.join(job.dest,os.path.basename(src))
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST,"Already exists in destination")
+    return dst
+
+def _job_delete(job, src):
+    job.touched.add((os.path.dirname(src),src))
+    _delete_tree(job,src)
+
+def _job_copy(job, src):
+    dst=_job_target(job,src)
+    job.touched.add((job.dest,None))
+    _copy_tree(job,src,dst)
+
+def _job_move(job, src):
+    dst=_job_target(job,src)
+    job.touched.add((os.path.dirname(src),src)); job.touched.add((job.dest,None))
+    if _same_device(src,job.dest):
+        job.check(); os.rename(src,dst); job.items_done+=1
+    else:
+        _copy_tree(job,src,dst)
+        _delete_tree(job,src,count=False)
+
+def _job_hash(job, src):
+    lib=get_library(); rel=rel_path(src)
+    lib.scan((rel,))
+    hash_files([os.path.join(BASE_DIR,p) for p,_ in lib.size_candidates(rel)],job)
+
+def _job_verify(job, src):
+    # Everything a DAT check needs: all files except zips, whose CRCs are read directly.
+    lib=get_library(); rel=rel_path(src)
+    lib.scan((rel,))
+    hash_files([os.path.join(BASE_DIR,p) for p,_ in lib.files_under(rel) if not p.lower().endswith('.zip')],job)
+
+JOB_OPS = {'delete':_job_delete,'copy':_job_copy,'move':_job_move,'hash':_job_hash,'verify':_job_verify}
+
+def run_job(job):
+    job.state='running'; job.started=time.time()
+    try:
+        for src in job.sources:
+            try:
+                # Hash jobs count only the files they actually have to read.
+                if job.kind in ('hash','verify'): pass
+                elif job.kind=='move' and _same_device(src,job.dest): job.items_total+=1
+                else: _measure(job,src)
+            except OSError: pass
+        for src in job.sources:
+            try: JOB_OPS[job.kind](job,src)
+            except OSError as e: job.errors.append(f"{rel_path(src)}: {e.strerror or e}")
+        job.state='failed' if job.errors else 'done'
+    except JobCancelled:
+        job.state='cancelled'
+    except Exception as e:
+        job.state='failed'; job.errors.append(str(e))
+    finally:
+        job.current=None
+        for path,removed in job.touched:
+            mark_changed(path,removed=removed)
+        job.finished=time.time(); job.done.set()
+
+class JobManager:
+    def __init__(self, workers=JOB_WORKERS):
+        self.jobs=OrderedDict()
+        self.lock=threading.Lock()
+        self.queue=queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self.work,name=f"job-worker-{i}",daemon=True).start()
+    def submit(self, job):
+        with self.lock:
+            self.jobs[job.id]=job
+            finished=[j.id for j in self.jobs.values() if j.finished]
+            for jid in finished[:max(0,len(finished)-JOB_HISTORY)]:
+                del self.jobs[jid]
+        self.queue.put(job)
+        return job
+    def get(self, job_id):
+        with self.lock: return self.jobs.get(job_id)
+    def list(self):
+        with self.lock: return list(self.jobs.values())
+    def cancel(self, job_id):
+        job=self.get(job_id)
+        if job and not job.finished: job.cancelled.set()
+        return job
+    def work(self):
+        while True:
+            job=self.queue.get()
+            if job.cancelled.is_set():
+                job.state='cancelled'; job.finished=time.time(); job.done.set()
+            else:
+                run_job(job)
+
+_jobs=None
+_jobs_lock=threading.Lock()
+
+def get_jobs():
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs=JobManager()
+    return _jobs
+
+def submit_job(kind, paths, dest=None):
+    """Validate and queue a job; returns (job, None) or (None, error message)."""
+    if kind not in JOB_OPS: return None,"Unknown operation."
+    sources=[]
+    for p in paths:
+        src=safe_path(p)
+        if kind in ('hash','verify'):
+            if not os.path.isdir(src): return None,f"Not a folder: {p}"
+        elif src==BASE_DIR: return None,"Cannot operate on the root folder."
+        if not os.path.lexists(src): return None,f"Not found: {p}"
+        if src not in sources: sources.append(src)
+    if not sources: return None,"Nothing selected."
+    if kind in ('copy','move'):
+        # '' is the RetroPie folder itself; a missing destination is an error, not the root.
+        if dest is None: return None,"A destination folder is required."
+        dest=safe_path(dest)
+        if not os.path.isdir(dest): return None,"Destination is not a folder."
+        for src in sources:
+            if os.path.commonpath([src,dest])==src: return None,"Cannot copy or move a folder into itself."
+    else:
+        dest=None
+    return get_jobs().submit(Job(kind,sources,dest)),None
+
+def flash_job(job, err, done_msg, busy_msg):
+    """Flash the outcome of a job submitted from a form, waiting briefly for it to end."""
+    if err: flash(err); return
+    if not job.done.wait(JOB_WAIT):
+        flash(f"{busy_msg} in the background; progress is shown under Background Jobs."); return
+    for e in job.errors: flash(f"Error: {e}")
+    if job.state=='done': flash(done_msg)
+
+@app.route('/api/jobs', methods=['GET','POST'])
+@requires_auth
+def api_jobs():
+    if request.method=='GET':
+        return jsonify([j.to_dict() for j in get_jobs().list()])
+    data=request.get_json(silent=True) or {}
+    if not isinstance(data,dict): return jsonify({'error':'Expected a JSON object.'}),400
+    paths=data.get('paths') or []
+    if not isinstance(paths,list) or not all(isinstance(p,str) for p in paths):
+        return jsonify({'error':'paths must be a list of strings.'}),400
+    if not isinstance(data.get('op'),str): return jsonify({'error':'Unknown operation.'}),400
+    if data.get('dest') is not None and not isinstance(data['dest'],str):
+        return jsonify({'error':'dest must be a string.'}),400
+    job,err=submit_job(data['op'],paths,data.get('dest'))
+    if err: return jsonify({'error':err}),400
+    return jsonify(job.to_dict()),202
+
+@app.route('/transfer_bulk', methods=['POST'])
+@requires_auth
+def transfer_bulk():
+    sel=request.form.getlist('selected_files')
+    op=request.form.get('op')
+    dest=request.form.get('dest')
+    if dest is not None: dest=dest.strip().strip('/')
+    if op not in ('copy','move'): abort(400)
+    job,err=submit_job(op,sel,dest)
+    if op=='copy': flash_job(job,err,"Selected items copied.","Copying selected items")
+    else: flash_job(job,err,"Selected items moved.","Moving selected items")
+    return redirect(url_for('dir_listing',req_path=posixpath.dirname(sel[0]) if sel else ''))
+
+@app.route('/api/jobs/<job_id>', methods=['GET','DELETE'])
+@requires_auth
+def api_job(job_id):
+    jobs=get_jobs()
+    job=jobs.cancel(job_id) if request.method=='DELETE' else jobs.get(job_id)
+    if job is None: abort(404)
+    return jsonify(job.to_dict())
+
+# --- DAT verification ---
+# Logiqx XML DATs (No-Intro, Redump, ...) are parsed with iterparse, one <game>
+# at a time, into the dat_roms table of library.db, whose (dat, crc32, size)
+# index serves as the hash -> entry lookup. Verification matches each file of
+# a folder by its cached hashes (see hash_files), so a re-run only reads files
+# added or changed since the last one. Zipped sets are checked from the CRC32s
+# in the archive's central directory without decompressing anything.
+DAT_BATCH = 5000
+
+def import_dat(f, system=None):
+    """Parse a Logiqx XML DAT from file object *f* into library.db; returns the new DAT's id."""
+    c=get_library().connect()
+    dat_id=c.execute("INSERT INTO dats (name,system,added) VALUES ('',?,?)",(system,time.time())).lastrowid
+    header={}; games=roms=0; batch=[]; root=None
+    try:
+        for event,el in ElementTree.iterparse(f,events=('start','end')):
+            if root is None: root=el
+            if event!='end': continue
+            if el.tag=='header':
+                header={k:(el.findtext(k) or '').strip() for k in ('name','description','version')}
+            elif el.tag in ('game','machine'):
+                game=el.get('name','')
+                for rom in el.iter('rom'):
+                    crc=(rom.get('crc') or '').lower() or None
+                    sha1=(rom.get('sha1') or '').lower() or None
+                    if not crc and not sha1: continue
+                    try: size=int(rom.get('size'))
+                    except (TypeError,ValueError): size=None
+                    batch.append((dat_id,game,rom.get('name',''),size,crc,(rom.get('md5') or '').lower() or None,sha1))
+                    roms+=1
+                games+=1
+                root.clear()
+                if len(batch)>=DAT_BATCH:
+                    c.executemany("INSERT INTO dat_roms VALUES (?,?,?,?,?,?,?)",batch); batch=[]
+        c.executemany("INSERT INTO dat_roms VALUES (?,?,?,?,?,?,?)",batch)
+        if not games: raise ValueError("No games found; is this a Logiqx XML DAT?")
+        c.execute("UPDATE dats SET name=?,description=?,version=?,games=?,roms=? WHERE id=?",
+                  (header.get('name') or 'Unnamed DAT',header.get('description'),header.get('version'),games,roms,dat_id))
+        c.commit()
+    except BaseException:
+        c.rollback()
+        raise
+    return dat_id
+
+def get_dats():
+    cols=('id','name','description','version','system','games','roms','added')
+    return [dict(zip(cols,r)) for r in get_library().connect().execute(f"SELECT {','.join(cols)} FROM dats ORDER BY name")]
+
+def get_dat(dat_id):
+    for d in get_dats():
+        if d['id']==dat_id: return d
+    abort(404)
+
+def _dat_match(c, dat_id, size, crc32, sha1=None):
+    return c.execute("SELECT game,name FROM dat_roms WHERE dat=? AND crc32=? AND size=? AND (sha1 IS NULL OR ? IS NULL OR sha1=?) LIMIT 1",
+                     (dat_id,crc32,size,sha1,sha1)).fetchone()
+
+def verify_report(dat_id, root):
+    """Check every file below *root* against DAT *dat_id*. Files are 'ok', 'misnamed'
+    (known content under another name), 'unknown' or 'unhashed' (not hashed yet)."""
+    lib=get_library(); c=lib.connect()
+    files=[]; found=set(); counts=dict.fromkeys(('ok','misnamed','unknown','unhashed'),0)
+    for path,size in lib.files_under(root):
+        full=os.path.join(BASE_DIR,path); name=posixpath.basename(path)
+        game=None; status='unknown'
+        if name.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(full) as z:
+                    members=[i for i in z.infolist() if not i.is_dir()]
+                hits=[_dat_match(c,dat_id,i.file_size,f"{i.CRC:08x}") for i in members]
+                if members and all(hits):
+                    game=hits[0][0]
+                    status='ok' if all(h[0]==game for h in hits) and os.path.splitext(name)[0]==game else 'misnamed'
+            except (OSError,zipfile.BadZipFile):
+                pass
+        else:
+            try: st=os.stat(full)
+            except OSError: continue
+            h=lib.cached_hash(st)
+            if h is None:
+                status='unhashed'
+            else:
+                hit=_dat_match(c,dat_id,st.st_size,h[0],h[2])
+                if hit: game=hit[0]; status='ok' if hit[1]==name else 'misnamed'
+        if game: found.add(game)
+        counts[status]+=1
+        files.append({'path':path,'size':size,'status':status,'game':game})
+    games=[r[0] for r in c.execute("SELECT DISTINCT game FROM dat_roms WHERE dat=? ORDER BY game",(dat_id,))]
+    missing=[g for g in games if g not in found]
+    return {'dat':get_dat(dat_id),'path':root,'counts':counts,'files':files,'have':len(found),'missing':missing}
+
+@app.route('/dats', methods=['GET','POST'])
+@requires_auth
+def dats():
+    if request.method=='POST':
+        f=request.files.get('file')
+        system=request.form.get('system') or None
+        if not f or not f.filename:
+            flash("No DAT file selected.")
+            return redirect(url_for('dats'))
+        try:
+            stream=f.stream
+            if zipfile.is_zipfile(stream):
+                z=zipfile.ZipFile(stream)
+                names=[n for n in z.namelist() if n.lower().endswith(('.dat','.xml'))]
+                if not names: raise ValueError("The archive contains no .dat or .xml file.")
+                stream=z.open(names[0])
+            else:
+                stream.seek(0)
+            import_dat(stream,system)
+            flash(f"DAT {f.filename} imported.")
+        except (ValueError,ElementTree.ParseError,zipfile.BadZipFile) as e:
+            flash(f"Could not import {f.filename}: {e}")
+        return redirect(url_for('dats'))
+    try: systems=sorted(e.name for e in os.scandir(os.path.join(BASE_DIR,'roms')) if e.is_dir())
+    except OSError: systems=[]
+    return render_template('dats.html', dats=get_dats(), systems=systems)
+
+@app.route('/dats/<int:dat_id>/delete', methods=['POST'])
+@requires_auth
+def delete_dat(dat_id):
+    c=get_library().connect()
+    c.execute("DELETE FROM dat_roms WHERE dat=?",(dat_id,)); c.execute("DELETE FROM dats WHERE id=?",(dat_id,)); c.commit()
+    flash("DAT removed.")
+    return redirect(url_for('dats'))
+
+def verify_root(dat):
+    default=f"roms/{dat['system']}" if dat['system'] else ''
+    return rel_path(safe_path(request.args.get('path',default)))
+
+@app.route('/dats/<int:dat_id>')
+@requires_auth
+def verify_dat(dat_id):
+    root=verify_root(get_dat(dat_id))
+    return render_template('dat_verify.html', report=verify_report(dat_id,root), library=get_library())
+
+@app.route('/api/dats')
+@requires_auth
+def api_dats():
+    return jsonify(get_dats())
+
+@app.route('/api/dats/<int:dat_id>/verify')
+@requires_auth
+def api_verify_dat(dat_id):
+    root=verify_root(get_dat(dat_id))
+    return jsonify(verify_report(dat_id,root))
+
+# --- Downloads ---
+# Files are served with a strong ETag built from inode, size and mtime, honour
+# If-None-Match / If-Modified-Since, and answer single byte ranges with 206 so
+# downloads can be resumed or split into segments. When the WSGI server offers
+# wsgi.file_wrapper (gunicorn uses sendfile for it) and the response runs to the
+# end of the file, the open file is handed over positioned at the range start
+# so the data never passes through Python. Ranges ending before EOF are
+# streamed in DOWNLOAD_BUFFER pieces, since not every file_wrapper stops at
+# Content-Length.
+DOWNLOAD_BUFFER = 1024*1024
+
+def file_etag(st):
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length>0:
+            buf=f.read(min(DOWNLOAD_BUFFER,length))
+            if not buf: break
+            length-=len(buf)
+            yield buf
+    finally:
+        f.close()
+
+def send_download(path):
+    f=TransferFile(path)
+    st=os.fstat(f.fileno())
+    size=st.st_size; etag=file_etag(st); modified=http_date(st.st_mtime)
+    headers={'ETag':etag,'Last-Modified':modified,'Accept-Ranges':'bytes','Cache-Control':'no-cache'}
+    if not is_resource_modified(request.environ,etag,last_modified=modified):
+        f.close()
+        return Response(status=304,headers=headers)
+    start,end,status=0,size,200
+    rng=parse_range_header(request.headers.get('Range'))
+    if_range=request.headers.get('If-Range')
+    # A stale If-Range validator means the client's partial copy is outdated: send everything.
+    if rng is not None and (not if_range or if_range in (etag,modified)) and len(rng.ranges)==1:
+        bounds=rng.range_for_length(size)
+        if bounds is None:
+            f.close()
+            headers['Content-Range']=f"bytes */{size}"
+            return Response(status=416,headers=headers)
+        start,end=bounds; status=206
+        headers['Content-Range']=f"bytes {start}-{end-1}/{size}"
+    headers['Content-Length']=str(end-start)
+    wrapper=request.environ.get('wsgi.file_wrapper')
+    if wrapper is not None and end==size:
+        f.seek(start); body=wrapper(f,DOWNLOAD_BUFFER)
+    else:
+        body=_read_range(f,start,end-start)
+    resp=Response(body,status=status,headers=headers,mimetype='application/octet-stream',direct_passthrough=True)
+    resp.headers.set('Content-Disposition','attachment',filename=os.path.basename(path))
+    resp.call_on_close(f.close)
+    return resp
+
+# --- Archive downloads ---
+# Folders and multi-selections are streamed as an uncompressed ZIP (ROMs are
+# usually compressed already) or a plain tar. zipfile/tarfile write into a
+# bounded queue from a producer thread and the response generator drains it,
+# so memory use is a few buffers regardless of archive size and nothing is
+# written to disk. Closing the response (client gone) stops the producer.
+ARCHIVE_QUEUE = 8
+
+class _QueueWriter:
+    def __init__(self):
+        self.q=queue.Queue(maxsize=ARCHIVE_QUEUE); self.buf=bytearray(); self.closed=False; self.failed=False
+    def write(self, data):
+        if self.failed: return len(data)
+        if self.closed: raise BrokenPipeError("archive download closed")
+        self.buf+=data
+        if len(self.buf)>=DOWNLOAD_BUFFER: self.flush()
+        return len(data)
+    def flush(self):
+        if self.buf:
+            while not self.closed:
+                try: self.q.put(bytes(self.buf),timeout=1); break
+                except queue.Full: pass
+            self.buf=bytearray()
+
+def archive_members(paths):
+    """Yield (absolute path, archive name) for *paths* and everything below them."""
+    for p in paths:
+        base=os.path.dirname(p)
+        yield p,os.path.relpath(p,base)
+        if os.path.isdir(p) and not os.path.islink(p):
+            for root,dirs,files in os.walk(p):
+                dirs.sort(); files.sort()
+                for n in dirs+files:
+                    full=os.path.join(root,n)
+                    yield full,os.path.relpath(full,base)
+
+def _write_archive(out, paths, fmt):
+    if fmt=='tar':
+        with tarfile.open(fileobj=out,mode='w|',format=tarfile.PAX_FORMAT) as tf:
+            for full,arc in archive_members(paths):
+                tf.add(full,arcname=arc,recursive=False)
+    else:
+        # Not a with-block: on an error the central directory must not be written
+        # (see _QueueWriter.failed), or the client would get a valid-looking
+        # archive that is missing files.
+        zf=zipfile.ZipFile(out,'w',zipfile.ZIP_STORED,allowZip64=True)
+        for full,arc in archive_members(paths):
+            if os.path.islink(full) and os.path.isdir(full): continue
+            # Files dated before 1980 (mtime 0 is common on ROM dumps) get 1980-01-01.
+            zi=zipfile.ZipInfo.from_file(full,arc,strict_timestamps=False)
+            zi.compress_type=zipfile.ZIP_STORED
+            if zi.is_dir(): zf.writestr(zi,b''); continue
+            with open(full,'rb') as src, zf.open(zi,'w') as dst:
+                shutil.copyfileobj(src,dst,DOWNLOAD_BUFFER)
+        zf.close()
+
+def archive_response(paths, fmt, name):
+    out=_QueueWriter(); done=object()
+    def produce():
+        end=done
+        try: _write_archive(out,paths,fmt); out.flush()
+        except Exception as e:
+            # Handed to body(), which raises it so the connection is aborted
+            # rather than ending like a complete archive.
+            if not out.closed: app.logger.warning("Archive download failed: %s",e)
+            out.failed=True; end=e
+        finally:
+            while not out.closed:
+                try: out.q.put(end,timeout=1); break
+                except queue.Full: pass
+    def body():
+        t=threading.Thread(target=produce,name="archive",daemon=True); t.start()
+        try:
+            with active_transfer():
+                while True:
+                    chunk=out.q.get()
+                    if chunk is done: break
+                    if isinstance(chunk,Exception): raise chunk
+                    yield chunk
+        finally:
+            out.closed=True
+    ext='tar' if fmt=='tar' else 'zip'
+    resp=Response(body(),mimetype='application/x-tar' if fmt=='tar' else 'application/zip',direct_passthrough=True)
+    resp.headers.set('Content-Disposition','attachment',filename=f"{name}.{ext}")
+    return resp
+
+@app.route('/download_bulk', methods=['POST'])
+@requires_auth
+def download_bulk():
+    sel=[safe_path(f) for f in request.form.getlist('selected_files')]
+    sel=[p for p in sel if os.path.exists(p) and p!=BASE_DIR]
+    if not sel:
+        flash("Nothing selected."); return redirect(url_for('dir_listing',req_path=''))
+    name=os.path.basename(sel[0]) if len(sel)==1 else "selection"
+    return archive_response(sel,request.form.get('format','zip'),name)
+
+@app.route('/archive/<path:req_path>')
+@requires_auth
+def download_folder(req_path):
+    p=safe_path(req_path)
+    if not os.path.isdir(p) or p==BASE_DIR:
+        flash("Not a folder."); return redirect(url_for('dir_listing',req_path=posixpath.dirname(req_path)))
+    return archive_response([p],request.args.get('format','zip'),os.path.basename(p))
+
 @app.route('/', defaults={'req_path':''})
 @app.route('/<path:req_path>')
 @requires_auth
 def dir_listing(req_path):
     sel=request.args.get('ssd_sensor')
-    if sel:
-        CONFIG['ssd_sensor']=sel; save_config(CONFIG)
+    if sel and sel!=CONFIG['ssd_sensor']:
+        CONFIG.update(ssd_sensor=sel)
     path=safe_path(req_path)
-    if not os.path.exists(path):
+    try: st=os.stat(path)
+    except OSError: st=None
+    if not st:
         return f"Not found: {req_path}",404
-    if os.path.isfile(path):
-        return send_from_directory(os.path.dirname(path),os.path.basename(path),as_attachment=True)
+    if stat.S_ISREG(st.st_mode):
+        return send_download(path)
+    # Pending flash messages are part of the page, so it is never cached then.
+    etag=None if session.get('_flashes') else listing_etag(path,st)
+    if etag and request.if_none_match.contains_weak(etag):
+        return tag_listing(Response(status=304),etag)
     mon=get_monitoring_data(request.args.get('ssd_sensor',CONFIG.get("ssd_sensor")))
-    files=[]
-    try:
-        for fn in os.listdir(path):
-            full=os.path.join(path,fn)
-            files.append({
-                'name':fn,
-                'path':os.path.join(req_path,fn),
-                'is_dir':os.path.isdir(full),
-                'mtime':os.path.getmtime(full),
-                'size':os.path.getsize(full) if os.path.isfile(full) else None,
-                'file_type':'folder' if os.path.isdir(full) else os.path.splitext(fn)[1].lower()
-            })
-    except PermissionError:
-        flash("Permission denied.")
     sort=request.args.get('sort','name')
     order=request.args.get('order','asc')
-    rev=(order=='desc')
-    if sort=='date':
-        files.sort(key=lambda x:x['mtime'],reverse=rev)
-    elif sort=='type':
-        files.sort(key=lambda x:(x['file_type'],x['name'].lower()),reverse=rev)
-    elif sort=='size':
-        files.sort(key=lambda x:x['size'] or 0,reverse=rev)
-    else:
-        files.sort(key=lambda x:x['name'].lower(),reverse=rev)
+    files=[]; version=None
+    try:
+        version,files=sorted_view(path,sort,order)
+    except PermissionError:
+        flash("Permission denied."); etag=None
+    request_folder_sizes(files)
+    # Only the first page is rendered; the rest is fetched from /api/list while scrolling.
+    total=len(files); files=files[:LIST_PAGE_SIZE]
     parent=posixpath.dirname(req_path)
-    return render_template_string("""
-<!doctype html>
-<html lang="en"><head>
-  <meta charset="utf-8"><title>RetroPie Light Web Game Manager</title>
-  <meta name="viewport"content="width=device-width,initial-scale=1">
-  <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css" rel="stylesheet">
-  <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" rel="stylesheet">
-  <style>
-  canvas { max-width: 300px; max-height: 300px; }
-  .progress { height: 35px; }
-  .progress-bar { color: black; font-size: 1.2em; font-weight: bold; }
-
-  /* ─── Upload specific styles ─── */
-
-  /* Container for upload progress */
-  #uploadProgress {
-    height: 16px;                   /* slightly smaller than default */
-    background-color: #e9ecef;      /* light grey background */
-    margin-top: 8px;                /* space above it */
-    border-radius: 4px;             /* rounded corners */
-  }
-
-  /* Inner bar for upload progress */
-  #uploadProgressBar {
-    background-color: #17a2b8;      /* a distinct color (teal) */
-    transition: width 0.3s ease;    /* smooth animation */
-  }
-
-  /* Optional striped/animated state */
-  #uploadProgressBar.striped {
-    background-image: linear-gradient(
-      45deg,
-      rgba(255,255,255,0.15) 25%,
-      transparent 25%,
-      transparent 50%,
-      rgba(255,255,255,0.15) 50%,
-      rgba(255,255,255,0.15) 75%,
-      transparent 75%,
-      transparent
-    );
-    background-size: 1rem 1rem;     /* stripe size */
-  }
-  #uploadProgressBar.animated {
-    animation: progress-bar-stripes 1s linear infinite;
-  }
-
-  @keyframes progress-bar-stripes {
-    from { background-position: 1rem 0; }
-    to   { background-position: 0   0; }
-  }
-</style>
-</head><body>
-  <div class="container py-4">
-    <h1 class="mb-4">RetroPie Light Web Game Manager</h1>
-    <div class="text-end mb-3">
-      <a href="{{url_for('edit_config')}}" class="btn btn-outline-warning"><i class="fas fa-edit"></i> Edit RPI config.txt</a>
-      <a href="{{url_for('settings')}}" class="btn btn-outline-secondary"><i class="fas fa-cog"></i> Settings</a>
-    </div>
-    {% with msgs=get_flashed_messages() %}
-      {% if msgs %}
-        {% for m in msgs %}
-          <div class="alert alert-warning">{{m}}</div>
-        {% endfor %}
-      {% endif %}
-    {% endwith %}
-    <!-- Monitoring -->
-    <div class="card mb-4">
-      <div class="card-header"><h3>Monitoring</h3></div>
-      <div class="card-body">
-        <div class="row mb-3">
-          <div class="col-md-3"><strong>CPU Temp:</strong> <span id="cpu-temp">{{mon.cpu_temp}}</span></div>
-          <div class="col-md-3"><strong>SSD Temp:</strong> <span id="ssd-temp">{{mon.ssd_temp}}</span>{% if mon.ssd_selected_name %}<br><small>{{mon.ssd_selected_name}}</small>{% endif %}</div>
-          <div class="col-md-3"><strong>Uptime:</strong> <span id="uptime">{{mon.uptime}}</span></div>
-          <div class="col-md-3">
-            {% if config.show_nvme and mon.ssd_all %}
-              <form method="get" class="d-flex align-items-center flex-wrap">
-                <label class="me-2 mb-1"><small>Select SSD Sensor:</small></label>
-                <input type="hidden" name="req_path" value="{{req_path}}">
-                <select name="ssd_sensor" id="ssd_sensor_select" class="form-select" style="max-width:200px" onchange="this.form.submit()">
-                  {% for s,t in mon.ssd_all.items() %}
-                    <option value="{{s}}" {% if s==mon.ssd_selected_name %}selected{% endif %}>{{s}}: {{t}}</option>
-                  {% endfor %}
-                </select>
-              </form>
-            {% endif %}
-          </div>
-        </div>
-        <div class="row mb-3">
-          <div class="col-md-4"><strong>CPU Frequency:</strong> <span id="cpu-usage-text">{{mon.cpu_freq_current}} MHz / {{mon.cpu_freq_max}} MHz</span></div>
-          <div class="col-md-4"><strong>Memory Usage:</strong> <span id="memory-usage-text">{{mon.mem_used | filesizeformat}} / {{mon.mem_total | filesizeformat}}</span></div>
-          <div class="col-md-4"></div>
-        </div>
-        <div class="row mb-3">
-          <div class="col-md-4"><strong>CPU Usage (Progress):</strong>
-            <div class="progress"><div id="cpuBar" class="progress-bar" role="progressbar" style="width:{{mon.cpu_usage}}%" aria-valuenow="{{mon.cpu_usage}}" aria-valuemin="0" aria-valuemax="100">{{mon.cpu_usage}}%</div></div>
-          </div>
-          <div class="col-md-4"><strong>Memory Usage (Progress):</strong>
-            <div class="progress"><div id="memBar" class="progress-bar bg-success" role="progressbar" style="width:{{mon.mem_percent}}%" aria-valuenow="{{mon.mem_percent}}" aria-valuemin="0" aria-valuemax="100">{{mon.mem_percent}}%</div></div>
-          </div>
-          <div class="col-md-4"><strong>Disk Usage:</strong> ({{mon.disk_used | filesizeformat}} / {{mon.disk_total | filesizeformat}})
-            <div class="progress"><div id="diskBar" class="progress-bar bg-info" role="progressbar" style="width:{{mon.disk_percent}}%" aria-valuenow="{{mon.disk_percent}}" aria-valuemin="0" aria-valuemax="100">{{mon.disk_percent}}%</div></div>
-          </div>
-        </div>
-      </div>
-    </div>
-    <!-- Control -->
-    <div class="card mb-4">
-      <div class="card-header"><h3>Control</h3></div>
-      <div class="card-body">
-        <form method="post" action="{{url_for('control')}}">
-          <button class="btn btn-warning mb-2" name="action" value="reboot">Reboot Raspberry Pi</button>
-          <button class="btn btn-danger mb-2" name="action" value="shutdown">Shutdown Raspberry Pi</button>
-        </form>
-      </div>
-    </div>
-    <!-- Upload & Create -->
-    <div class="card mb-4">
-      <div class="card-header"><h3>Upload Files / Create Folder</h3></div>
-      <div class="card-body">
-        <div class="row">
-          <div class="col-md-6">
-            <form id="uploadForm" action="{{url_for('upload_file',req_path=req_path)}}" method="post" enctype="multipart/form-data">
-              <div class="mb-3"><input type="file" name="file" class="form-control" multiple></div>
-              <button type="submit" class="btn btn-primary"><i class="fas fa-upload"></i> Upload</button>
-              <button type="button" id="cancelUpload" class="btn btn-secondary" style="display:none;">Cancel Upload</button>
-            </form>
-            <div id="uploadProgress" class="progress" style="display:none;">
-              <div id="uploadProgressBar" class="progress-bar" role="progressbar" style="width:0%;">0%</div>
-            </div>
-            <div id="uploadInfo" class="text-center mt-2"></div>
-          </div>
-          <div class="col-md-6">
-            <form action="{{url_for('create_folder',req_path=req_path)}}" method="post">
-              <div class="mb-3"><input type="text" name="folder_name" placeholder="Folder Name" class="form-control"></div>
-              <button class="btn btn-secondary"><i class="fas fa-folder-plus"></i> Create Folder</button>
-            </form>
-          </div>
-        </div>
-      </div>
-    </div>
-    <!-- File List -->
-    <form method="post" action="{{url_for('delete_bulk')}}">
-      <div class="card">
-        <div class="card-header"><h3>File and Folder List</h3>
-          <div class="mt-2">
-            <span>Sort by:</span>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='name',order='asc')}}" class="btn btn-sm btn-outline-primary">Name ↑</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='name',order='desc')}}" class="btn btn-sm btn-outline-primary">Name ↓</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='date',order='asc')}}" class="btn btn-sm btn-outline-secondary">Date ↑</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='date',order='desc')}}" class="btn btn-sm btn-outline-secondary">Date ↓</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='type',order='asc')}}" class="btn btn-sm btn-outline-info">Type ↑</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='type',order='desc')}}" class="btn btn-sm btn-outline-info">Type ↓</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='size',order='asc')}}" class="btn btn-sm btn-outline-dark">Size ↑</a>
-            <a href="{{url_for('dir_listing',req_path=req_path,sort='size',order='desc')}}" class="btn btn-sm btn-outline-dark">Size ↓</a>
-          </div>
-        </div>
-        <div class="card-body">
-          <nav aria-label="breadcrumb"><ol class="breadcrumb">
-            <li class="breadcrumb-item"><a href="{{url_for('dir_listing',req_path='')}}"><i class="fas fa-home"></i> Home</a></li>
-            {% if req_path %}
-              {% set parts=req_path.split('/') %}{% set acc="" %}
-              {% for p in parts %}
-                {% set acc=acc+p %}
-                <li class="breadcrumb-item"><a href="{{url_for('dir_listing',req_path=acc)}}">{{p}}</a></li>
-                {% set acc=acc+"/" %}
-              {% endfor %}
-            {% endif %}
-          </ol></nav>
-          <table class="table table-striped table-hover">
-            <thead><tr>
-              <th><input type="checkbox" id="select-all" onclick="toggleSelectAll(this)"></th>
-              <th>Icon</th><th>Name</th><th>Type</th><th>Modified</th><th>Size</th><th>Actions</th>
-            </tr></thead>
-            <tbody>
-              {% if req_path %}
-                <tr><td colspan="7">
-                  <a href="{{url_for('dir_listing',req_path=parent)}}" class="btn btn-sm btn-outline-dark">
-                    <i class="fas fa-level-up-alt"></i> [..]
-                  </a>
-                </td></tr>
-              {% endif %}
-              {% for f in files %}
-                <tr>
-                  <td><input type="checkbox" name="selected_files" value="{{f.path}}"></td>
-                  <td>{% if f.is_dir %}<i class="fas fa-folder fa-lg text-warning"></i>{% else %}<i class="fas fa-file fa-lg text-secondary"></i>{% endif %}</td>
-                  <td>{% if f.is_dir %}<a href="{{url_for('dir_listing',req_path=f.path)}}">{{f.name}}/</a>{% else %}{{f.name}}{% endif %}</td>
-                  <td>{{f.file_type}}</td>
-                  <td>{{f.mtime|datetimeformat}}</td>
-                  <td>{{f.size|filesizeformat}}</td>
-                  <td>
-                    {% if f.is_dir %}
-                      <a href="{{url_for('dir_listing',req_path=f.path)}}" class="btn btn-sm btn-primary"><i class="fas fa-folder-open"></i></a>
-                      <a href="{{url_for('delete_folder',req_path=f.path)}}" class="btn btn-sm btn-danger" onclick="return confirm('Delete folder?');"><i class="fas fa-trash-alt"></i></a>
-                    {% else %}
-                      <a href="{{url_for('dir_listing',req_path=f.path)}}" class="btn btn-sm btn-success"><i class="fas fa-download"></i></a>
-                      <a href="{{url_for('edit_file',req_path=f.path)}}" class="btn btn-sm btn-warning"><i class="fas fa-edit"></i></a>
-                      <a href="{{url_for('delete_file',req_path=f.path)}}" class="btn btn-sm btn-danger" onclick="return confirm('Delete file?');"><i class="fas fa-trash-alt"></i></a>
-                    {% endif %}
-                  </td>
-                </tr>
-              {% endfor %}
-            </tbody>
-          </table>
-          <button class="btn btn-danger" onclick="return confirm('Delete selected?');">Delete Selected</button>
-        </div>
-      </div>
-    </form>
-  </div>
-<script>
-function humanSize(b){
-  if(b>=1024*1024*1024) return (b/1024/1024/1024).toFixed(2)+" GB";
-  if(b>=1024*1024) return (b/1024/1024).toFixed(2)+" MB";
-  return (b/1024).toFixed(2)+" KB";
-}
-function toggleSelectAll(src){
-  document.querySelectorAll('input[name="selected_files"]').forEach(cb=>cb.checked=src.checked);
-}
-// Monitoring update
-function updateMonitoring(){
-  let sensor=document.getElementById("ssd_sensor_select");
-  let param=sensor?"?ssd_sensor="+sensor.value:"";
-  fetch("/api/monitoring"+param).then(r=>r.json()).then(data=>{
-    document.getElementById("cpu-temp").textContent=data.cpu_temp;
-    document.getElementById("ssd-temp").textContent=data.ssd_temp;
-    let cpuBar=document.getElementById("cpuBar");
-    cpuBar.style.width=data.cpu_usage+"%"; cpuBar.textContent=data.cpu_usage+"%";
-    let memBar=document.getElementById("memBar");
-    memBar.style.width=data.mem_percent+"%"; memBar.textContent=data.mem_percent+"%";
-    let diskBar=document.getElementById("diskBar");
-    diskBar.style.width=data.disk_percent+"%"; diskBar.textContent=data.disk_percent+"%";
-    document.getElementById("cpu-usage-text").textContent=data.cpu_freq_current+" MHz / "+data.cpu_freq_max+" MHz";
-    document.getElementById("memory-usage-text").textContent=data.mem_used_human+" / "+data.mem_total_human;
-    document.getElementById("uptime").textContent=data.uptime;
-  }).catch(e=>console.error(e));
-}
-document.addEventListener("DOMContentLoaded",()=>{
-  setInterval(updateMonitoring, {{config['monitor_refresh']*1000}});
-  let form=document.getElementById("uploadForm"), xhr;
-  const prog=document.getElementById("uploadProgress"),
-        bar=document.getElementById("uploadProgressBar"),
-        info=document.getElementById("uploadInfo"),
-        btnCancel=document.getElementById("cancelUpload");
-  form.addEventListener("submit",e=>{
-    e.preventDefault();
-    const fd=new FormData(form);
-    xhr=new XMLHttpRequest();
-    xhr.open("POST", form.action, true);
-    prog.style.display="block"; btnCancel.style.display="inline-block";
-    let lastLoaded=0, lastTime=Date.now(), totalSize=0;
-    xhr.upload.addEventListener("loadstart",()=>{
-      totalSize=0;
-      for(let v of fd.values()){
-        if(v.size) totalSize+=v.size;
-      }
-    });
-    xhr.upload.addEventListener("progress",e=>{
-      if(e.lengthComputable){
-        const now=Date.now(), deltaTime=(now-lastTime)/1000, deltaLoaded=e.loaded-lastLoaded;
-        const speed=deltaLoaded/deltaTime, rem=totalSize-e.loaded, eta=rem/speed;
-        lastTime=now; lastLoaded=e.loaded;
-        bar.style.width=Math.round((e.loaded/totalSize)*100)+"%";
-        bar.textContent=Math.round((e.loaded/totalSize)*100)+"%";
-        let speedStr="", remStr="", doneStr="";
-        if(speed>=1024*1024*1024) speedStr=(speed/1024/1024/1024).toFixed(2)+" GB/s";
-        else if(speed>=1024*1024) speedStr=(speed/1024/1024).toFixed(2)+" MB/s";
-        else if(speed>=1024) speedStr=(speed/1024).toFixed(2)+" KB/s";
-        else speedStr=speed.toFixed(2)+" B/s";
-        doneStr=humanSize(e.loaded)+"/"+humanSize(totalSize);
-        remStr=humanSize(rem)+" Remaining";
-        let h=Math.floor(eta/3600), m=Math.floor((eta%3600)/60), s=Math.floor(eta%60);
-        let etaStr=(h?h+"h ":"")+(m?m+"m ":"")+(s? s+"s":"");
-        info.textContent=`Speed: ${speedStr} • Done upload: ${doneStr} • ${remStr} • ETA: ${etaStr}`;
-      }
-    });
-    xhr.onload=()=>{
-      if(xhr.status==200){
-        alert("File(s) uploaded successfully.");
-        window.location.reload();
-      } else alert("Error uploading file.");
-    };
-    xhr.send(fd);
-    btnCancel.onclick=()=>{
-      if(xhr){xhr.abort(); info.textContent="Upload canceled."; btnCancel.style.display="none";}
-    };
-  });
-});
-</script>
-<script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/js/bootstrap.bundle.min.js"></script>
-</body></html>
-""", mon=mon, files=files, req_path=req_path, parent=parent, config=CONFIG)
+    # The page is streamed, so flashed messages are taken out of the session
+    # here: once the body is being sent the session cookie can no longer change.
+    resp=Response(stream_template('dir_listing.html', messages=get_flashed_messages(), mon=mon, files=files, total=total, view=version, page_size=LIST_PAGE_SIZE, entry_size=entry_size, sort=sort, order=order, req_path=req_path, parent=parent, config=CONFIG))
+    return tag_listing(resp,etag) if etag else resp
+
+# --- Serving ---
+# By default the panel runs under gunicorn with a single gthread worker (all
+# caches, background threads and upload state live in one process) and a pool
+# of `threads` request threads, HTTP keep-alive and graceful shutdown on the
+# SIGTERM systemd sends. Without gunicorn installed, a Werkzeug server with a
+# fixed thread pool, socket timeouts and clean SIGTERM handling is used instead
+# (Werkzeug always closes connections, so there is no keep-alive in that mode).
+# debug=True in config.cfg restores the development server with debugger and
+# reloader.
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+    def __init__(self, host, port, app, threads, handler=None):
+        super().__init__(host, port, app, handler=handler)
+        # Daemon threads rather than a ThreadPoolExecutor, whose threads Python
+        # joins at exit: a request still running after graceful_timeout must not
+        # keep the process alive.
+        self.requests=queue.Queue(); self.active=0; self.idle=threading.Condition()
+        for i in range(threads):
+            threading.Thread(target=self._worker,name=f"http_{i}",daemon=True).start()
+    def process_request(self, request, client_address):
+        with self.idle: self.active+=1
+        self.requests.put((request,client_address))
+    def _worker(self):
+        while True:
+            request,client_address=self.requests.get()
+            try: self.finish_request(request,client_address)
+            except Exception: self.handle_error(request,client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.idle:
+                    self.active-=1; self.idle.notify_all()
+    def drain(self, timeout):
+        """Wait up to *timeout* seconds for accepted requests to finish; False if some are still running."""
+        with self.idle: return self.idle.wait_for(lambda: self.active==0,timeout)
+
+def serve_werkzeug(host, port):
+    class Handler(WSGIRequestHandler):
+        timeout=CONFIG["request_timeout"]
+    srv=PooledWSGIServer(host,port,app,CONFIG["threads"],handler=Handler)
+    def stop(signum, frame):
+        SHUTTING_DOWN.set()
+        # shutdown() blocks until serve_forever() returns, so it cannot run in the signal handler's thread.
+        threading.Thread(target=srv.shutdown,daemon=True).start()
+    signal.signal(signal.SIGTERM,stop); signal.signal(signal.SIGINT,stop)
+    CONFIG.watch()
+    app.logger.info("Serving on http://%s:%s with %s threads",host,port,CONFIG["threads"])
+    try: srv.serve_forever()
+    finally: srv.server_close()
+    if not srv.drain(CONFIG["graceful_timeout"]):
+        app.logger.warning("Stopping with %s requests still running after %ss",srv.active,CONFIG["graceful_timeout"])
+
+def serve_gunicorn(host, port):
+    from gunicorn.app.base import BaseApplication
+    def worker_started(worker):
+        # Background threads have to be started in the worker, after the fork.
+        CONFIG.watch()
+        # gunicorn's SIGTERM handler only stops accepting; also end the monitoring streams.
+        exit_handler=signal.getsignal(signal.SIGTERM)
+        def stop(signum, frame):
+            SHUTTING_DOWN.set(); exit_handler(signum,frame)
+        signal.signal(signal.SIGTERM,stop)
+    class PanelServer(BaseApplication):
+        def load_config(self):
+            for k,v in {
+                'bind':f"{host}:{port}",'workers':1,'worker_class':'gthread','threads':CONFIG["threads"],
+                'keepalive':CONFIG["keepalive"],'timeout':CONFIG["request_timeout"],
+                'graceful_timeout':CONFIG["graceful_timeout"],'errorlog':'-',
+                'post_worker_init':worker_started,
+            }.items():
+                self.cfg.set(k,v)
+        def load(self):
+            return app
+    PanelServer().run()
+
+def serve(host='0.0.0.0', port=None):
+    port=port or CONFIG["port"]
+    if CONFIG.get("debug"):
+        app.run(host=host,port=port,debug=True,threaded=True)
+        return
+    try:
+        import gunicorn
+    except ImportError:
+        serve_werkzeug(host,port)
+    else:
+        serve_gunicorn(host,port)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=CONFIG["port"], debug=True)
+    serve()